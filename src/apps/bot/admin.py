@@ -1,7 +1,12 @@
-from apps.bot.models import TelegramUser
+from apps.bot.models import TelegramFile, TelegramUser
 from django.contrib import admin
 
 
 @admin.register(TelegramUser)
 class TelegramUserAdmin(admin.ModelAdmin):
     pass
+
+
+@admin.register(TelegramFile)
+class TelegramFileAdmin(admin.ModelAdmin):
+    list_display = ('content_hash', 'file_id', 'created_at')
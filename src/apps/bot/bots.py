@@ -1,20 +1,21 @@
 import logging
+import math
 import os
 import threading
 import time
-from base64 import b64decode
-from io import BytesIO
-from pathlib import Path, PosixPath
-from typing import Optional, Union
+from pathlib import Path
+from typing import Callable, Optional, Union
 
 import telebot
-from apps.bot.models import TelegramUser
+from apps.bot.models import TelegramFile, TelegramUser
 from apps.bot.utils import constants, markups, tools, txts
+from apps.bot.utils.payloads import BinaryPayload
+from apps.bot.utils.scheduler import BULK, INTERACTIVE, SendScheduler
 from apps.bot.utils.tools import WBPersonalApiClient
 from django.conf import settings
 from telebot.apihelper import ApiTelegramException as TelegramException
-from telebot.types import (CallbackQuery, InlineKeyboardMarkup, Message,
-                           ReplyKeyboardMarkup)
+from telebot.types import (CallbackQuery, InlineKeyboardMarkup,
+                           InputMediaPhoto, Message, ReplyKeyboardMarkup)
 
 logger = telebot.logger
 fh = logging.FileHandler(os.path.join(settings.BASE_DIR, 'logs/bot_log.log'))
@@ -25,10 +26,9 @@ class BaseBot(telebot.TeleBot):
 
     def __init__(self, token, *args, **kwargs):
         self.DEBUG = settings.DEBUG
-        self.BASE_DIR = Path(__file__).resolve().parent
-        self.TEMPORARY_DIR = os.path.join(self.BASE_DIR, 'temporary_files')
         self.ADMIN_USER_ID = constants.ADMIN_USER_ID
         self.markups = markups.Markups()
+        self.scheduler = SendScheduler()
         self.logger = logger
         super().__init__(token=token, parse_mode='html', threaded=False, *args, **kwargs)
 
@@ -38,17 +38,12 @@ class BaseBot(telebot.TeleBot):
     def send_admin_message(self, message_text: str) -> Message:
         return self.send(self.ADMIN_USER_ID, message_text)
 
-    def download_file(self, message: Message, file_id: str = None) -> Path:
-        if file_id is None:
-            file_id = message.document.file_id
-            file_name = message.document.file_name
-        else:
-            file_name = 'photo'
-        downloaded_file = super().download_file(self.get_file(file_id).file_path)
-        src = os.path.join(self.TEMPORARY_DIR, f'{message.from_user.id}_{file_name}')
-        with open(src, 'wb') as new_file:
-            new_file.write(downloaded_file)
-        return Path(src)
+    def download_payload(self, message: Message) -> BinaryPayload:
+        """
+            Скачивает присланный документ в память, без временного файла
+        """
+        data = super().download_file(self.get_file(message.document.file_id).file_path)
+        return BinaryPayload.from_bytes(data, message.document.file_name, message.document.mime_type)
 
     def log_error(self, error: Exception, exc_info: bool = True):
         if hasattr(self, 'pill2kill'):
@@ -59,23 +54,89 @@ class BaseBot(telebot.TeleBot):
         self.logger.error(error, exc_info=exc_info)
 
     def send(self, chat_id: int, text: str,
-             markup: Union[ReplyKeyboardMarkup, InlineKeyboardMarkup] = None) -> Message:
-        return super().send_message(chat_id, text, parse_mode='html', reply_markup=markup, disable_web_page_preview=True)
-
-    def send_photo(self, chat_id: int, photo: Union[Path, str],
-                   caption: str, markup: Union[ReplyKeyboardMarkup, InlineKeyboardMarkup] = None) -> Message:
-        if type(photo) is PosixPath or (type(photo) is str and photo.startswith('/')):
-            return super().send_photo(chat_id, photo if type(photo) is str else open(photo, 'rb+'), caption=caption, parse_mode='html', reply_markup=markup)
-        else:
-            return super().send_photo(chat_id, BytesIO(b64decode(photo.encode('ascii'))), caption=caption, parse_mode='html', reply_markup=markup)
-
-    def send_document(self, chat_id: int, path: Union[Path, PosixPath, str],
+             markup: Union[ReplyKeyboardMarkup, InlineKeyboardMarkup] = None, priority: str = INTERACTIVE) -> Message:
+        send_message = super().send_message
+        return self.scheduler.call(
+            chat_id,
+            lambda: send_message(chat_id, text, parse_mode='html', reply_markup=markup, disable_web_page_preview=True),
+            priority
+        )
+
+    @staticmethod
+    def _get_payload(file: Union[BinaryPayload, Path]) -> BinaryPayload:
+        if isinstance(file, BinaryPayload):
+            return file
+        if isinstance(file, Path):
+            return BinaryPayload.from_path(file)
+        raise TypeError('Unsupported file type: %s' % type(file).__name__)
+
+    def _send_file(self, chat_id: int, payload: BinaryPayload, file_type: str, send: Callable,
+                   file_name: str = None, priority: str = INTERACTIVE) -> Message:
+        """
+            Отправляет файл по сохраненному file_id, если такой файл уже загружался,
+            иначе загружает и запоминает file_id из ответа.
+            Если Telegram не принял file_id - файл загружается заново
+        """
+        content_hash = TelegramFile.get_content_hash(payload, file_type, file_name)
+        file_id = TelegramFile.get_file_id(content_hash)
+        if file_id is not None:
+            try:
+                return self.scheduler.call(chat_id, lambda: send(file_id), priority)
+            except TelegramException as err:
+                if err.error_code != 400:
+                    raise
+                self.logger.warning('Cached file_id %s rejected: %s' % (file_id, err.description))
+                TelegramFile.objects.filter(content_hash=content_hash).delete()
+        message = self.scheduler.call(chat_id, lambda: send(payload.as_upload(file_name)), priority)
+        TelegramFile.remember(content_hash, file_type, message)
+        return message
+
+    def send_photo(self, chat_id: int, photo: Union[BinaryPayload, Path],
+                   caption: str, markup: Union[ReplyKeyboardMarkup, InlineKeyboardMarkup] = None, priority: str = INTERACTIVE) -> Message:
+        send_photo = super().send_photo
+        return self._send_file(
+            chat_id,
+            self._get_payload(photo),
+            TelegramFile.PHOTO,
+            lambda file: send_photo(chat_id, file, caption=caption, parse_mode='html', reply_markup=markup),
+            priority=priority
+        )
+
+    def send_document(self, chat_id: int, document: Union[BinaryPayload, Path],
                       markup: Union[ReplyKeyboardMarkup, InlineKeyboardMarkup] = None,
-                      caption: str = None, file_name: str = None) -> Message:
-        if type(path) is PosixPath or (type(path) is str and path.startswith('/')):
-            return super().send_document(chat_id, open(path, 'rb'), reply_markup=markup, caption=caption, parse_mode='html', visible_file_name=file_name)
-        else:
-            return super().send_document(chat_id, BytesIO(b64decode(path.encode('ascii'))), reply_markup=markup, caption=caption, parse_mode='html', visible_file_name=file_name)
+                      caption: str = None, file_name: str = None, priority: str = INTERACTIVE) -> Message:
+        send_document = super().send_document
+        return self._send_file(
+            chat_id,
+            self._get_payload(document),
+            TelegramFile.DOCUMENT,
+            lambda file: send_document(chat_id, file, reply_markup=markup, caption=caption, parse_mode='html'),
+            file_name=file_name,
+            priority=priority
+        )
+
+    def send_media_group(self, chat_id: int, media: list, priority: str = INTERACTIVE) -> list:
+        send_media_group = super().send_media_group
+        return self.scheduler.call(chat_id, lambda: send_media_group(chat_id, media), priority)
+
+    def send_photo_urls(self, chat_id: int, photos: list, priority: str = INTERACTIVE) -> list:
+        """
+            Отправляет фото по ссылкам медиагруппами, photos - список (ссылка, подпись или None).
+            В медиагруппе может быть только от 2 до MEDIA_GROUP_MAX_SIZE фото, поэтому фото
+            делятся на группы поровну, а одно фото отправляется отдельным сообщением
+        """
+        if len(photos) == 1:
+            send_photo = super().send_photo
+            url, caption = photos[0]
+            return [self.scheduler.call(chat_id, lambda: send_photo(chat_id, url, caption=caption, parse_mode='html'), priority)]
+        messages = []
+        groups = math.ceil(len(photos) / constants.MEDIA_GROUP_MAX_SIZE)
+        for i in range(groups):
+            group = photos[i * len(photos) // groups:(i + 1) * len(photos) // groups]
+            messages += self.send_media_group(
+                chat_id, [InputMediaPhoto(url, caption=caption, parse_mode='html') for url, caption in group], priority
+            )
+        return messages
 
     def delete(self, chat_id: int, message_id: int) -> bool:
         try:
@@ -97,12 +158,6 @@ class BaseBot(telebot.TeleBot):
         except TelegramException:
             pass
 
-    def _delete_file(self, path: Union[Path, list, tuple]) -> None:
-        if type(path) is list or type(path) is tuple:
-            for file in path:
-                os.remove(file)
-        os.remove(path)
-
     def loading(self, stop_event: threading.Event, message: Message, text: str, step: int, send: bool = True, markup: Optional[Union[InlineKeyboardMarkup, ReplyKeyboardMarkup]] = None) -> None:
         loading = {
             2: '...',
@@ -176,6 +231,12 @@ class Bot(BaseBot):
             user.unactive = True
             user.save()
 
+    def restore_user(self, user_id: int):
+        """
+            Если пользователь снова разблокировал бота то ставит unactive в False
+        """
+        TelegramUser.objects.filter(user_id=user_id, unactive=True).update(unactive=False)
+
     def register_new_user(self, message: Message) -> None:
         """
             Обрабатываем отправленный пользователем контает и создаем объект пользователя в базе данных
@@ -363,9 +424,7 @@ class Bot(BaseBot):
         user = self.get_user(message.from_user.id)
         if user.personal_set.filter(id=int(personal_id)).exists():
             personal = user.personal_set.get(id=int(personal_id))
-            file = self.download_file(message)
-            added_articles = tools.add_articles_to_track(personal, file)
-            tools.delete_files([file])
+            added_articles = tools.add_articles_to_track(personal, self.download_payload(message))
             if added_articles[0]:
                 if len(added_articles[1]) == 0:
                     return self.send(message.chat.id, '<b>🤷🏼‍♂️ Вы не выбрали ни одного артикула для отслеживания</b>')
@@ -385,9 +444,7 @@ class Bot(BaseBot):
         self.delete(message.chat.id, message.id)
         self.delete(message.chat.id, message.id-1)
         user = self.get_user(message.from_user.id)
-        file = self.download_file(message)
-        removed_articles = tools.remove_articles_from_track(user, file)
-        tools.delete_files([file])
+        removed_articles = tools.remove_articles_from_track(user, self.download_payload(message))
         if removed_articles[0]:
             if len(removed_articles[1]) == 0:
                 return self.send(message.chat.id, '<b>🤷🏼‍♂️ Вы не выбрали ни одного артикула для удаления из отслеживания</b>')
@@ -450,8 +507,39 @@ class Bot(BaseBot):
                 self.change_stars_process
             )
 
+    def notify_new_feedbacks_digest(self, user: TelegramUser, feedbacks: list):
+        """
+            Отправляет несколько отзывов одним сообщением, а их фотографии - медиагруппами
+        """
+        if len(feedbacks) == 1:
+            return self.notify_new_feedback(feedbacks[0])
+        # первое фото каждого отзыва подписано артикулом, чтобы было понятно, к какому отзыву оно относится
+        photos = [
+            (photo.url, feedback.format_photo_caption() if i == 0 else None)
+            for feedback in feedbacks for i, photo in enumerate(feedback.feedbackphoto_set.all())
+        ]
+        self.send_photo_urls(user.user_id, photos, priority=BULK)
+        message_text = '<b>🔔 Новые отзывы: %i</b>\n\n' % len(feedbacks)
+        for i, feedback in enumerate(feedbacks):
+            block = feedback.format_digest_message()
+            if len(message_text) + len(block) > constants.MESSAGE_MAX_LENGTH - 50:
+                message_text += '<i>и еще %i шт.</i>' % (len(feedbacks) - i)
+                break
+            message_text += block
+        return self.send(user.user_id, message_text, priority=BULK)
+
+    def notify_token_expired(self, user: TelegramUser) -> Message:
+        return self.send(
+            user.user_id,
+            '<b>🔒 Wildberries больше не принимает вашу авторизацию, уведомления об отзывах приостановлены</b>\n'
+            '<i>Авторизуйтесь в кабинете заново по кнопке ниже ⤵️</i>',
+            self.markups.authorize_wb(),
+            priority=BULK
+        )
+
     def notify_new_feedback(self, feedback: object):
         if len(feedback.feedbackphoto_set.all()) != 0:
-            return self.send_photo(feedback.article.personal.user.user_id, tools.merge_card_images([photo.url for photo in feedback.feedbackphoto_set.all()]), feedback.format_notification_message(), self.markups.href_nmid(feedback.article.nmId))
-        else:
-            return self.send(feedback.article.personal.user.user_id, feedback.format_notification_message(), self.markups.href_nmid(feedback.article.nmId))
+            photo = tools.merge_card_images([photo.url for photo in feedback.feedbackphoto_set.all()])
+            if photo is not None:
+                return self.send_photo(feedback.article.personal.user.user_id, photo, feedback.format_notification_message(), self.markups.href_nmid(feedback.article.nmId), priority=BULK)
+        return self.send(feedback.article.personal.user.user_id, feedback.format_notification_message(), self.markups.href_nmid(feedback.article.nmId), priority=BULK)
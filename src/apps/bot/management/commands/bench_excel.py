@@ -0,0 +1,103 @@
+import io
+import multiprocessing
+import resource
+import time
+
+import openpyxl
+from apps.bot.utils.excel import build_excel
+from apps.bot.utils.tools import get_card_excel_row
+from apps.polls.models import Card
+from django.core.management import BaseCommand
+from openpyxl.styles import Alignment, Border, Color, Font, PatternFill, Side
+
+HEADERS = [
+    'Артикул WB', 'Артикул продавца', 'Бренд', 'Предмет', 'Цвет', 'Размер', 'Баркод', 'Заполните да, если нужно отслеживать товар'
+]
+
+
+def make_cards(count: int) -> list:
+    return [
+        Card(
+            nmId=str(10000000 + i),
+            vendor_code='vendor-code-%i' % i,
+            brand='Бренд %i' % (i % 50),
+            subject='Предмет %i' % (i % 200),
+            color='черный, белый' if i % 3 else '',
+            size=str(40 + i % 10),
+            barcode='2000000%07i' % i
+        )
+        for i in range(count)
+    ]
+
+
+def legacy_excel(cards: list) -> bytes:
+    wb = openpyxl.Workbook()
+    sheet = wb.active
+    sheet.cell(row=1, column=1).value = 'Список товаров'
+    for i, header in enumerate(HEADERS):
+        sheet.cell(row=2, column=i+1).value = header
+    sheet.merge_cells(start_row=1, end_row=1, start_column=1, end_column=len(HEADERS))
+    for row in range(1, 3):
+        for column in range(1, len(HEADERS)+1):
+            cell = sheet.cell(row=row, column=column)
+            cell.fill = PatternFill(start_color=Color('B1A0C7'), end_color=Color('B1A0C7'), fill_type='solid')
+            cell.font = Font(bold=True, size=12)
+            cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
+            cell.border = Border(left=Side(style='medium'), right=Side(style='medium'), top=Side(style='medium'), bottom=Side(style='medium'))
+    row = 3
+    for card in cards:
+        for column, value in enumerate(get_card_excel_row(card, False), 1):
+            sheet.cell(row=row, column=column).value = value
+        sheet.cell(row=row, column=1).alignment = Alignment(horizontal='center')
+        sheet.cell(row=row, column=1).hyperlink = f'https://www.wildberries.ru/catalog/{card.nmId}/detail.aspx?targetUrl=SP'
+        row += 1
+    dims = {}
+    for sheet_row in sheet.rows:
+        for cell in sheet_row:
+            if cell.value:
+                dims[cell.column_letter] = max((dims.get(cell.column_letter, 0), len(str(cell.value)) + 10))
+    for col, value in dims.items():
+        sheet.column_dimensions[col].width = value
+    file_stream = io.BytesIO()
+    wb.save(file_stream)
+    return file_stream.getvalue()
+
+
+def streaming_excel(cards: list) -> bytes:
+    payload = build_excel(
+        'Список товаров', HEADERS, (get_card_excel_row(card, False) for card in cards), 'bench.xlsx', {1: 15, 7: 15, 8: 28}
+    )
+    return payload.getbuffer().tobytes()
+
+
+def run(export, count: int, queue) -> None:
+    cards = make_cards(count)
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started_at = time.perf_counter()
+    data = export(cards)
+    elapsed = time.perf_counter() - started_at
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((elapsed, len(data), base_rss, peak_rss))
+
+
+class Command(BaseCommand):
+    help = 'Compare the streaming cards Excel export with the legacy in-memory workbook'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cards', type=int, nargs='+', default=[1000, 10000, 100000])
+
+    def handle(self, *args, **options):
+        # каждый замер в отдельном процессе, чтобы пиковый RSS не наследовался от предыдущего
+        context = multiprocessing.get_context('fork')
+        for count in options['cards']:
+            for name, export in (('legacy', legacy_excel), ('streaming', streaming_excel)):
+                queue = context.Queue()
+                process = context.Process(target=run, args=(export, count, queue))
+                process.start()
+                elapsed, size, base_rss, peak_rss = queue.get()
+                process.join()
+                self.stdout.write(
+                    '%6i cards %-9s %8.2f s %8.1f KB  peak RSS %7.1f MB (+%.1f MB)' % (
+                        count, name, elapsed, size / 1024, peak_rss / 1024, (peak_rss - base_rss) / 1024
+                    )
+                )
@@ -0,0 +1,59 @@
+import io
+import time
+
+from apps.bot.utils.images import get_collage_grid, render_collage
+from django.core.management import BaseCommand
+from PIL import Image
+
+
+def make_photo(width: int, height: int) -> bytes:
+    image = Image.effect_noise((width, height), 64).convert('RGB')
+    file_stream = io.BytesIO()
+    image.save(file_stream, 'JPEG', quality=90)
+    return file_stream.getvalue()
+
+
+def legacy_merge(photos: list) -> bytes:
+    images = [Image.open(io.BytesIO(photo)) for photo in photos]
+    widths, heights = zip(*(i.size for i in images))
+    new_im = Image.new('RGB', (sum(widths), max(heights)))
+    x_offset = 0
+    for im in images:
+        new_im.paste(im, (x_offset, 0))
+        x_offset += im.size[0]
+    file_stream = io.BytesIO()
+    new_im.save(file_stream, 'png')
+    return file_stream.getvalue()
+
+
+def collage_merge(photos: list) -> bytes:
+    _, _, cell = get_collage_grid(len(photos))
+    images = []
+    for photo in photos:
+        image = Image.open(io.BytesIO(photo))
+        image.draft('RGB', (cell, cell))
+        images.append(image)
+    return render_collage(images)
+
+
+class Command(BaseCommand):
+    help = 'Compare feedback photo collage rendering with the legacy side-by-side PNG'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--photos', type=int, nargs='+', default=[1, 3, 5, 10])
+        parser.add_argument('--size', type=int, nargs=2, default=[900, 1200], metavar=('WIDTH', 'HEIGHT'))
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        photo = make_photo(*options['size'])
+        for count in options['photos']:
+            photos = [photo] * count
+            for name, merge in (('legacy', legacy_merge), ('collage', collage_merge)):
+                started_at = time.perf_counter()
+                for _ in range(options['repeat']):
+                    result = merge(photos)
+                elapsed = (time.perf_counter() - started_at) / options['repeat']
+                width, height = Image.open(io.BytesIO(result)).size
+                self.stdout.write(
+                    '%2i photos %-8s %8.1f ms %10.1f KB %6ix%i' % (count, name, elapsed * 1000, len(result) / 1024, width, height)
+                )
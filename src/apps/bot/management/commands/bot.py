@@ -34,6 +34,11 @@ def bot_kicked(member):
     bot.kick_user(member.from_user.id)
 
 
+@bot.my_chat_member_handler(func=lambda member: member.new_chat_member.status == 'member')
+def bot_restored(member):
+    bot.restore_user(member.from_user.id)
+
+
 @bot.message_handler(content_types=['contact'])
 def recieve_contact(message):
     try:
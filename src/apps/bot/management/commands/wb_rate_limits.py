@@ -0,0 +1,16 @@
+from apps.bot.models import TelegramUser
+from apps.bot.utils.ratelimit import wb_api_limiter
+from django.core.management import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Show WB API rate limiter state per WBToken'
+
+    def handle(self, *args, **kwargs):
+        for user in TelegramUser.objects.exclude(WBToken=None):
+            state = wb_api_limiter.state(user.WBToken)
+            self.stdout.write(
+                '%s: tokens %.2f, last request %s, next allowed %s' % (
+                    user, state['tokens'], state['last_request_at'] or '-', state['next_allowed_at'] or 'now'
+                )
+            )
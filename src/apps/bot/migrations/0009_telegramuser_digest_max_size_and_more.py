@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0008_telegramuser_notification_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='telegramuser',
+            name='digest_max_size',
+            field=models.PositiveSmallIntegerField(default=10, verbose_name='Максимум отзывов в одном уведомлении'),
+        ),
+        migrations.AddField(
+            model_name='telegramuser',
+            name='digest_window',
+            field=models.PositiveIntegerField(default=0, verbose_name='Окно группировки уведомлений, сек (0 - без группировки)'),
+        ),
+    ]
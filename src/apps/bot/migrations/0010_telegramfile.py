@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0009_telegramuser_digest_max_size_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TelegramFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64, unique=True, verbose_name='Хэш содержимого')),
+                ('file_id', models.CharField(max_length=255, verbose_name='ИД файла в Telegram')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата загрузки')),
+            ],
+            options={
+                'verbose_name': 'Файл в Telegram',
+                'verbose_name_plural': 'Файлы в Telegram',
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0010_telegramfile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='telegramuser',
+            name='token_expired_notified',
+            field=models.BooleanField(default=False, verbose_name='Пользователь уведомлен об истекшей авторизации?'),
+        ),
+        migrations.AddField(
+            model_name='telegramuser',
+            name='token_failures',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Ошибок авторизации WB подряд'),
+        ),
+        migrations.AddField(
+            model_name='telegramuser',
+            name='token_retry_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Следующая проверка WBToken'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0011_telegramuser_token_expired_notified_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='telegramuser',
+            index=models.Index(condition=models.Q(('WBToken__isnull', False), ('notification', True), ('unactive', False)), fields=['token_retry_at'], name='telegramuser_eligible'),
+        ),
+    ]
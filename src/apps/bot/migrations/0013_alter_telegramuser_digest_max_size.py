@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:14
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0012_telegramuser_telegramuser_eligible'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='telegramuser',
+            name='digest_max_size',
+            field=models.PositiveSmallIntegerField(default=10, validators=[django.core.validators.MinValueValidator(1)], verbose_name='Максимум отзывов в одном уведомлении'),
+        ),
+    ]
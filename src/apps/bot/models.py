@@ -1,4 +1,32 @@
+import hashlib
+import zipfile
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+
+from apps.bot.utils.payloads import BinaryPayload
+from django.conf import settings
+from django.core.validators import MinValueValidator
 from django.db import models
+from django.utils import timezone
+
+
+class TelegramUserQuerySet(models.QuerySet):
+
+    def authorized(self):
+        """
+            Пользователи с рабочим WBToken, не заблокировавшие бота
+        """
+        return self.filter(
+            models.Q(token_retry_at__isnull=True) | models.Q(token_retry_at__lte=timezone.now()),
+            WBToken__isnull=False, unactive=False
+        )
+
+    def notifiable(self):
+        """
+            Авторизованные пользователи с включенными уведомлениями. Какие их кабинеты
+            опрашивать, решает Personal.objects.pollable
+        """
+        return self.authorized().filter(notification=True)
 
 
 class TelegramUser(models.Model):
@@ -11,10 +39,23 @@ class TelegramUser(models.Model):
     notification = models.BooleanField('Уведомления включены?', default=True)
     notification_stars = models.SmallIntegerField('Кол-во звезд для уведомлений', null=False, blank=False, default=5)
     unactive = models.BooleanField('Пользователь заблокировал бота?', default=False)
+    digest_window = models.PositiveIntegerField('Окно группировки уведомлений, сек (0 - без группировки)', default=0)
+    digest_max_size = models.PositiveSmallIntegerField('Максимум отзывов в одном уведомлении', default=10, validators=[MinValueValidator(1)])
+    token_failures = models.PositiveSmallIntegerField('Ошибок авторизации WB подряд', default=0)
+    token_retry_at = models.DateTimeField('Следующая проверка WBToken', null=True, blank=True)
+    token_expired_notified = models.BooleanField('Пользователь уведомлен об истекшей авторизации?', default=False)
+
+    objects = TelegramUserQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Пользователь телеграмма'
         verbose_name_plural = 'Пользователи телеграмма'
+        indexes = [
+            models.Index(
+                fields=['token_retry_at'], condition=models.Q(notification=True, unactive=False, WBToken__isnull=False),
+                name='telegramuser_eligible'
+            )
+        ]
 
     def reset_temp_token(self):
         self.temp_token = None
@@ -26,12 +67,111 @@ class TelegramUser(models.Model):
 
     def set_WBToken(self, WBToken: str):
         self.WBToken = WBToken
+        self.reset_token_health()
         self.save()
 
     def reset_WBToken(self):
         self.WBToken = None
+        self.reset_token_health()
         self.personal_set.all().delete()
         self.save()
 
+    def reset_token_health(self):
+        self.token_failures = 0
+        self.token_retry_at = None
+        self.token_expired_notified = False
+
+    def is_token_expired(self) -> bool:
+        return self.token_failures >= settings.WB_TOKEN_FAILURE_THRESHOLD
+
+    def record_token_success(self):
+        if self.token_failures == 0:
+            return
+        self.reset_token_health()
+        self.save(update_fields=['token_failures', 'token_retry_at', 'token_expired_notified'])
+
+    def record_token_failure(self):
+        """
+            WB отклонил WBToken. После WB_TOKEN_FAILURE_THRESHOLD ошибок подряд токен
+            не опрашивается до token_retry_at, пауза между проверками растет вдвое
+            до WB_TOKEN_PROBE_MAX_INTERVAL
+        """
+        self.token_failures += 1
+        if self.is_token_expired():
+            probes = self.token_failures - settings.WB_TOKEN_FAILURE_THRESHOLD
+            self.token_retry_at = timezone.now() + timedelta(
+                seconds=min(settings.WB_TOKEN_PROBE_MAX_INTERVAL, settings.WB_TOKEN_PROBE_INTERVAL * 2 ** min(probes, 32))
+            )
+        self.save(update_fields=['token_failures', 'token_retry_at'])
+
+    def mark_token_expired_notified(self):
+        self.token_expired_notified = True
+        self.save(update_fields=['token_expired_notified'])
+
+    def get_notification_send_at(self) -> datetime:
+        """
+            Когда отправлять уведомление о новом отзыве. С включенной группировкой время
+            округляется вверх до границы окна digest_window (со сдвигом по pk, чтобы окна разных
+            пользователей не совпадали), поэтому отзывы из одного окна уходят одним сообщением
+        """
+        now = timezone.now()
+        if self.digest_window == 0:
+            return now
+        offset = self.pk % self.digest_window
+        slot = (now.timestamp() - offset) // self.digest_window + 1
+        return datetime.fromtimestamp(slot * self.digest_window + offset, tz=dt_timezone.utc)
+
     def __str__(self):
         return self.username if self.username is not None else str(self.user_id)
+
+
+class TelegramFile(models.Model):
+    """
+        Файлы, уже загруженные в Telegram: по хэшу содержимого хранится file_id,
+        которым файл можно отправить повторно без загрузки
+    """
+    PHOTO = 'photo'
+    DOCUMENT = 'document'
+
+    content_hash = models.CharField('Хэш содержимого', max_length=64, unique=True)
+    file_id = models.CharField('ИД файла в Telegram', max_length=255)
+    created_at = models.DateTimeField('Дата загрузки', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Файл в Telegram'
+        verbose_name_plural = 'Файлы в Telegram'
+
+    @staticmethod
+    def get_content_hash(payload: BinaryPayload, file_type: str, file_name: str = None) -> str:
+        """
+            sha256 от типа, имени и содержимого файла. Для zip (xlsx) хэшируются
+            распакованные части без docProps/core.xml, так как openpyxl пишет туда
+            время сохранения и одинаковые таблицы иначе давали бы разные хэши
+        """
+        content_hash = hashlib.sha256(('%s:%s:' % (file_type, file_name or payload.file_name or '')).encode('utf-8'))
+        if zipfile.is_zipfile(payload.open()):
+            with zipfile.ZipFile(payload.open()) as archive:
+                for name in sorted(archive.namelist()):
+                    if name == 'docProps/core.xml':
+                        continue
+                    content_hash.update(name.encode('utf-8'))
+                    content_hash.update(archive.read(name))
+        else:
+            with payload.getbuffer() as data:
+                content_hash.update(data)
+        return content_hash.hexdigest()
+
+    @classmethod
+    def get_file_id(cls, content_hash: str):
+        return cls.objects.filter(content_hash=content_hash).values_list('file_id', flat=True).first()
+
+    @classmethod
+    def remember(cls, content_hash: str, file_type: str, message: object) -> None:
+        if file_type == cls.PHOTO:
+            file_id = message.photo[-1].file_id
+        else:
+            file_id = message.document.file_id
+        cls.objects.update_or_create(content_hash=content_hash, defaults={'file_id': file_id})
+
+    def __str__(self):
+        return self.file_id
@@ -1,42 +1,300 @@
+import asyncio
+import math
 from datetime import datetime, timedelta
 
+from apps.bot.management.commands.bot import bot
 from apps.bot.models import TelegramUser
-from apps.bot.utils import tools
-from apps.bot.utils.tools import WBPersonalApiClient
+from apps.bot.utils import async_tools, tools
+from apps.bot.utils.locks import (RedisLeases, acquire_lease, release_lease,
+                                  renew_lease)
+from apps.polls.models import (Feedback, FeedbackNotification, FeedbackPhoto,
+                               Personal)
+from celery import chord, group
 from core.celery import app
-from django.db.models import Q
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
 from django.utils import timezone
+from loguru import logger
+
+POLL_CYCLE_LEASE = 'feedbacks-poll-cycle'
+
+
+def get_poll_lease_name(supplier_id: str) -> str:
+    return 'feedbacks-poll:%s' % supplier_id
+
+
+def get_supplier_personals(supplier_ids: list) -> dict:
+    """
+        :return dict: supplierId -> список кабинетов пользователей с этим продавцом
+    """
+    suppliers = {}
+    for personal in Personal.objects.pollable().select_related('user').filter(supplierId__in=supplier_ids).order_by('pk'):
+        suppliers.setdefault(personal.supplierId, []).append(personal)
+    return suppliers
 
 
 @app.task(name='Send new feedbacks notification')
 def send_new_feedback_notification():
-    for user in TelegramUser.objects.filter(Q(notification=True) and ~Q(WBToken=None)):
-        fetch_new_feedbacks(user.pk)
+    """
+        Ставит в очередь получение отзывов для каждого продавца, у которого хотя бы
+        один кабинет дождался времени опроса (Personal.next_poll_at).
+        Кабинеты одного продавца у разных пользователей опрашиваются одним запросом.
+        Продавцы делятся на FEEDBACK_POLL_CONCURRENCY пачек, чтобы один цикл
+        занимал не больше этого количества воркеров одновременно.
+        При FEEDBACK_POLL_ENGINE=asyncio каждая пачка опрашивается одной задачей через asyncio.
+        Пока предыдущий цикл не завершился (держит аренду в Redis), новый не запускается
+    """
+    cycle_token = acquire_lease(POLL_CYCLE_LEASE, settings.FEEDBACK_POLL_CYCLE_TTL)
+    if cycle_token is None:
+        logger.warning('Previous feedbacks poll cycle is still running, skip')
+        return 0
+    suppliers = list(
+        Personal.objects.pollable().filter(
+            Q(next_poll_at__isnull=True) | Q(next_poll_at__lte=timezone.now())
+        ).order_by().values_list('supplierId', flat=True).distinct()
+    )
+    if len(suppliers) == 0:
+        release_lease(POLL_CYCLE_LEASE, cycle_token)
+        return 0
+    chunk_size = math.ceil(len(suppliers) / settings.FEEDBACK_POLL_CONCURRENCY)
+    if settings.FEEDBACK_POLL_ENGINE == 'asyncio':
+        header = group(
+            fetch_new_feedbacks_async.s(suppliers[i:i + chunk_size], cycle_token) for i in range(0, len(suppliers), chunk_size)
+        )
+    else:
+        header = fetch_new_feedbacks.chunks([(supplier_id, cycle_token) for supplier_id in suppliers], chunk_size).group()
+    # если задача пачки упала, chord не вызовет summarize_new_feedbacks - аренду цикла снимет errback
+    callback = summarize_new_feedbacks.s(len(suppliers), timezone.now().isoformat(), cycle_token)
+    chord(header)(callback.on_error(release_poll_cycle.si(cycle_token)))
+    return len(suppliers)
+
+
+@app.task(name='Release feedbacks poll cycle')
+def release_poll_cycle(cycle_token):
+    logger.error('Feedbacks poll cycle failed, release lease')
+    release_lease(POLL_CYCLE_LEASE, cycle_token)
+
+
+@app.task(name='Summarize new feedbacks')
+def summarize_new_feedbacks(results, total_suppliers, started_at, cycle_token=None):
+    if cycle_token is not None:
+        release_lease(POLL_CYCLE_LEASE, cycle_token)
+    new_feedbacks = sum(sum(chunk) for chunk in results)
+    elapsed = timezone.now() - datetime.fromisoformat(started_at)
+    logger.success('Feedbacks poll cycle finished: suppliers %i, new feedbacks %i, elapsed %s' % (total_suppliers, new_feedbacks, elapsed))
+    return new_feedbacks
 
 
 @app.task(name='Fetch new feedbacks')
-def fetch_new_feedbacks(pk):
-    if TelegramUser.objects.filter(pk=pk).exists():
-        user = TelegramUser.objects.get(pk=pk)
-        for personal in user.personal_set.all():
-            client = WBPersonalApiClient(personal.supplierId, user.WBToken)
-            feedbacks = client.get_feedbacks()
-            if feedbacks[0]:
-                for feedback in feedbacks[1]:
-                    if personal.trackedarticle_set.filter(nmId=str(feedback['nmId'])).exists() and feedback['productValuation'] <= user.notification_stars:
-                        article = personal.trackedarticle_set.get(nmId=str(feedback['nmId']))
-                        if not article.feedback_set.filter(wb_id=feedback['id']).exists():
-                            print(datetime.strptime(feedback['createdDate'], '%Y-%m-%dT%H:%M:%SZ'))
-                            new_feedback = article.feedback_set.create(
-                                wb_id=feedback['id'],
-                                text=feedback['text'],
-                                stars=feedback['productValuation'],
-                                created_date=timezone.make_aware(datetime.strptime(feedback['createdDate'], '%Y-%m-%dT%H:%M:%SZ') + timedelta(hours=3))
-                            )
-                            if len(feedback['photoLinks']) != 0:
-                                for photo_link in feedback['photoLinks']:
-                                    new_feedback.feedbackphoto_set.create(url=photo_link['miniSize'])
-                            new_feedback.send_notify()
+def fetch_new_feedbacks(supplier_id, cycle_token=None):
+    """
+        Получает новые отзывы продавца одним запросом и раздает их
+        всем пользователям, у которых добавлен этот кабинет.
+        Если продавца уже опрашивает другая задача - пропускает его.
+        Ошибка одного продавца не роняет задачу, иначе остальные продавцы
+        пачки (chunks) не опрашиваются, а chord не завершается
+
+        :return int: количество новых отзывов
+    """
+    with RedisLeases([get_poll_lease_name(supplier_id)], settings.FEEDBACK_POLL_LEASE_TTL) as leases:
+        if len(leases.acquired) == 0:
+            logger.warning('Supplier %s is already being polled, skip' % supplier_id)
+            return 0
+        created = 0
+        try:
+            personals = get_supplier_personals([supplier_id]).get(supplier_id, [])
+            if len(personals) != 0:
+                feedbacks = tools.get_supplier_feedbacks(personals)
+                if feedbacks[0]:
+                    created = sum(save_new_feedbacks(personal, feedbacks[1]) for personal in personals)
+                notify_expired_tokens(personals)
+        except Exception as err:
+            logger.exception('Error fetching feedbacks [%s]: %s' % (supplier_id, err))
+            created = 0
+    if cycle_token is not None:
+        renew_lease(POLL_CYCLE_LEASE, cycle_token, settings.FEEDBACK_POLL_CYCLE_TTL)
+    return created
+
+
+@app.task(name='Fetch new feedbacks async')
+def fetch_new_feedbacks_async(supplier_ids, cycle_token=None):
+    """
+        Опрашивает пачку продавцов конкурентно через asyncio,
+        после чего сохраняет отзывы и отправляет уведомления.
+        Продавцы, которых уже опрашивает другая задача, пропускаются.
+        Ошибка одного продавца дает 0 по нему и не роняет пачку
+
+        :return list: количество новых отзывов по каждому продавцу
+    """
+    leases = RedisLeases([get_poll_lease_name(supplier_id) for supplier_id in supplier_ids], settings.FEEDBACK_POLL_LEASE_TTL)
+    with leases:
+        acquired = [supplier_id for supplier_id in supplier_ids if get_poll_lease_name(supplier_id) in leases.acquired]
+        suppliers = list(get_supplier_personals(acquired).values())
+        responses = asyncio.run(async_tools.get_suppliers_feedbacks(suppliers))
+        created = []
+        for personals, (feedbacks, attempts) in zip(suppliers, responses):
+            try:
+                for token, response in attempts:
+                    tools.record_token_result(personals, token, response)
+                created.append(sum(save_new_feedbacks(personal, feedbacks[1]) for personal in personals) if feedbacks[0] else 0)
+                notify_expired_tokens(personals)
+            except Exception as err:
+                logger.exception('Error saving feedbacks [%s]: %s' % (personals[0].supplierId, err))
+                created.append(0)
+    if cycle_token is not None:
+        renew_lease(POLL_CYCLE_LEASE, cycle_token, settings.FEEDBACK_POLL_CYCLE_TTL)
+    return created
+
+
+def notify_expired_tokens(personals: list) -> None:
+    """
+        Один раз сообщает пользователям, чей WBToken WB перестал принимать,
+        что нужно заново авторизоваться в кабинете
+    """
+    users = {personal.user.pk: personal.user for personal in personals}
+    for user in users.values():
+        if not user.is_token_expired() or user.token_expired_notified:
+            continue
+        try:
+            bot.notify_token_expired(user)
+        except Exception as err:
+            logger.error('Error notifying expired token [%s]: %s' % (user.pk, err))
+            continue
+        user.mark_token_expired_notified()
+
+
+def save_new_feedbacks(personal: Personal, feedbacks: list) -> int:
+    """
+        Сохраняет еще не известные отзывы по отслеживаемым артикулам кабинета вместе с
+        уведомлениями о них в очереди, сдвигает отметку последнего отзыва и назначает следующий опрос.
+        feedbacks могут быть получены для нескольких кабинетов продавца сразу,
+        поэтому сначала отбрасываются отзывы старше отметки самого кабинета
+
+        :return int: количество новых отзывов
+    """
+    user = personal.user
+    new_for_personal = tools.filter_new_feedbacks(feedbacks, personal.last_feedback_date, personal.last_feedback_id)
+    articles = {article.nmId: article for article in personal.trackedarticle_set.all()}
+    candidates = [
+        feedback for feedback in new_for_personal
+        if feedback.nmId in articles and feedback.stars <= user.notification_stars
+    ]
+    seen = set(
+        Feedback.objects.filter(
+            article__personal=personal, wb_id__in=[feedback.id for feedback in candidates]
+        ).values_list('wb_id', flat=True)
+    ) if len(candidates) != 0 else set()
+    new_feedbacks = []
+    photo_links = {}
+    for feedback in candidates:
+        if feedback.id in seen:
+            continue
+        seen.add(feedback.id)
+        new_feedbacks.append(Feedback(
+            article=articles[feedback.nmId],
+            wb_id=feedback.id,
+            text=feedback.text,
+            stars=feedback.stars,
+            created_date=feedback.created_date
+        ))
+        photo_links[feedback.id] = feedback.photos
+    with transaction.atomic():
+        Feedback.objects.bulk_create(new_feedbacks, ignore_conflicts=True)
+        # с ignore_conflicts pk не возвращаются: перечитываем вставленные, отзывы
+        # параллельной задачи с тем же wb_id уже в очереди уведомлений и пропускаются
+        new_feedbacks = list(Feedback.objects.filter(
+            article__personal=personal, wb_id__in=list(photo_links), feedbacknotification__isnull=True
+        ).order_by('pk'))
+        FeedbackPhoto.objects.bulk_create([
+            FeedbackPhoto(feedback=new_feedback, url=url)
+            for new_feedback in new_feedbacks for url in photo_links[new_feedback.wb_id]
+        ])
+        send_at = user.get_notification_send_at()
+        FeedbackNotification.objects.bulk_create([
+            FeedbackNotification(feedback=new_feedback, next_attempt_at=send_at) for new_feedback in new_feedbacks
+        ])
+        personal.set_feedbacks_watermark(feedbacks)
+        personal.schedule_next_poll(len(new_for_personal))
+        if len(new_feedbacks) != 0:
+            transaction.on_commit(lambda: send_feedback_notifications.apply_async(eta=send_at))
+    return len(new_feedbacks)
+
+
+def claim_feedback_notifications() -> list:
+    """
+        Забирает пачку уведомлений к отправке. Забранным уведомлениям сдвигается
+        next_attempt_at, чтобы параллельный отправитель их не взял, а при падении
+        процесса они вернулись в очередь через FEEDBACK_NOTIFICATION_CLAIM_TTL
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        pks = list(
+            FeedbackNotification.objects.select_for_update(skip_locked=True).filter(
+                sent_at__isnull=True, next_attempt_at__lte=now, attempts__lt=settings.FEEDBACK_NOTIFICATION_MAX_ATTEMPTS
+            ).order_by('next_attempt_at').values_list('pk', flat=True)[:settings.FEEDBACK_NOTIFICATION_BATCH]
+        )
+        FeedbackNotification.objects.filter(pk__in=pks).update(
+            next_attempt_at=now + timedelta(seconds=settings.FEEDBACK_NOTIFICATION_CLAIM_TTL)
+        )
+    return list(
+        FeedbackNotification.objects.select_related('feedback__article__personal__user').filter(pk__in=pks).order_by('feedback__created_date')
+    )
+
+
+@app.task(name='Send feedback notifications')
+def send_feedback_notifications():
+    """
+        Отправляет уведомления из очереди пачками, пока в ней есть готовые к отправке.
+        Пользователям с включенной группировкой отзывы уходят сводками до digest_max_size штук.
+        Уведомление помечается отправленным только после успешной отправки,
+        неудачные повторяются с экспоненциальной паузой
+
+        :return int: количество отправленных уведомлений
+    """
+    sent = 0
+    while True:
+        notifications = claim_feedback_notifications()
+        if len(notifications) == 0:
+            return sent
+        users = {}
+        for notification in notifications:
+            users.setdefault(notification.feedback.article.personal.user, []).append(notification)
+        for user, user_notifications in users.items():
+            size = max(1, user.digest_max_size) if user.digest_window != 0 else 1
+            for i in range(0, len(user_notifications), size):
+                batch = user_notifications[i:i + size]
+                try:
+                    if len(batch) == 1:
+                        batch[0].feedback.send_notify()
+                    else:
+                        bot.notify_new_feedbacks_digest(user, [notification.feedback for notification in batch])
+                except Exception as err:
+                    logger.error('Error sending feedback notifications %s: %s' % ([notification.pk for notification in batch], err))
+                    for notification in batch:
+                        notification.mark_failed(err)
+                    continue
+                for notification in batch:
+                    notification.mark_sent()
+                sent += len(batch)
+
+
+@app.task(name='Refresh cards')
+def refresh_cards():
+    """
+        Догружает изменения карточек в кабинетах, каталог которых уже загружался,
+        чтобы выгрузка товаров не ждала WB. Раз в CARDS_FULL_SYNC_INTERVAL загрузка
+        кабинета полная и убирает из каталога удаленные в WB карточки
+    """
+    refreshed = 0
+    personals = Personal.objects.filter(user__in=TelegramUser.objects.authorized(), cards_synced_at__isnull=False)
+    for personal in personals.select_related('user').iterator():
+        try:
+            if personal.refresh_cards()[0]:
+                refreshed += 1
+        except Exception as err:
+            logger.error('Error refreshing cards [%s]: %s' % (personal.pk, err))
+    return refreshed
 
 
 @app.task(name='Update table sheets')
@@ -53,19 +311,17 @@ def update_table_sheets():
     if len(requests) != 0:
         tools.delete_sheets(service, requests)
 
-    for user in TelegramUser.objects.filter(Q(notification=True) and ~Q(WBToken=None)):
-        for personal in user.personal_set.all():
-            if len(personal.trackedarticle_set.all()) != 0:
-                sheet_name = f'#{personal.id} {personal.name}'
-                response = tools.add_sheet(service, sheet_name)
-                table_values = [
-                    ['Артикул WB(ссылка)', 'Артикул поставщика', 'Кол-во отзывов']
-                ]
-                for article in personal.trackedarticle_set.all():
-                    table_values.append([
-                        f'=HYPERLINK("https://www.wildberries.ru/catalog/{article.nmId}/detail.aspx?targetUrl=SP"; "{article.nmId}")',
-                        article.article,
-                        '' if len(article.feedback_set.all()) == 0 else len(article.feedback_set.all())
-                        ])
-                tools.append_table_values(service, sheet_name, table_values)
-                tools.auto_resize_sheet(service, response.get('replies')[0].get('addSheet').get('properties').get('sheetId'))
+    for personal in Personal.objects.pollable().order_by('pk').iterator():
+        sheet_name = f'#{personal.id} {personal.name}'
+        response = tools.add_sheet(service, sheet_name)
+        table_values = [
+            ['Артикул WB(ссылка)', 'Артикул поставщика', 'Кол-во отзывов']
+        ]
+        for article in personal.trackedarticle_set.annotate(feedbacks_count=Count('feedback')).order_by('pk'):
+            table_values.append([
+                f'=HYPERLINK("https://www.wildberries.ru/catalog/{article.nmId}/detail.aspx?targetUrl=SP"; "{article.nmId}")',
+                article.article,
+                '' if article.feedbacks_count == 0 else article.feedbacks_count
+                ])
+        tools.append_table_values(service, sheet_name, table_values)
+        tools.auto_resize_sheet(service, response.get('replies')[0].get('addSheet').get('properties').get('sheetId'))
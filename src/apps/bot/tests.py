@@ -1,6 +1,32 @@
-from apps.bot.models import TelegramUser
+import io
+import json
+from datetime import timedelta
+from unittest import mock
+
+import openpyxl
+from apps.bot import tasks
+from apps.bot.models import TelegramFile, TelegramUser
+from apps.bot.utils import tools
+from apps.bot.utils.async_tools import AsyncWBPersonalApiClient
+from apps.bot.utils.constants import CARDS_PAGE_SIZE, FEEDBACKS_PAGE_SIZE
+from apps.bot.utils.excel import build_excel
+from apps.bot.utils.images import ImageCache, render_collage
+from apps.bot.utils.payloads import BinaryPayload
+from apps.bot.utils.ratelimit import get_retry_delay
+from apps.bot.utils.records import (CardRecord, FeedbackRecord, SupplierRecord,
+                                    parse_card_date, parse_wb_date)
+from apps.bot.utils.scheduler import BULK, SendScheduler
+from apps.bot.utils.tools import (WBPersonalApiClient, add_articles_to_track,
+                                  get_personal_cards_excel, get_suppliers,
+                                  remove_articles_from_track)
+from apps.polls.models import (Feedback, FeedbackNotification, FeedbackPhoto,
+                               Personal)
+from django.conf import settings
 from django.test import TestCase  # noqa
 from django.utils import timezone
+from PIL import Image
+from telebot import TeleBot
+from telebot.apihelper import ApiTelegramException as TelegramException
 
 
 class WBPersonalApiClientTestCase(TestCase):
@@ -26,3 +52,448 @@ class WBPersonalApiClientTestCase(TestCase):
 
     def test_login_personal(self):
         pass
+
+
+class FetchNewFeedbacksTestCase(TestCase):
+
+    def setUp(self):
+        self.start_time = timezone.now()
+        user = TelegramUser.objects.create(user_id=1, WBToken='token', notification_stars=3)
+        self.personal = user.personal_set.create(supplierId='supplier', oldId=1, name='ИП', full_name='ИП')
+        self.personal.trackedarticle_set.create(nmId='100', article='A-100')
+        self.personal.trackedarticle_set.create(nmId='200', article='A-200')
+
+    def tearDown(self):
+        t = timezone.now() - self.start_time
+        print(f'{self.id()}: {t}')
+
+    def make_feedback(self, wb_id, nmId, stars=1, photos=0, created_date='2023-03-10T10:00:00Z'):
+        return FeedbackRecord.from_wb({
+            'id': wb_id,
+            'nmId': nmId,
+            'text': 'Отзыв',
+            'productValuation': stars,
+            'createdDate': created_date,
+            'photoLinks': [{'miniSize': f'https://example.com/{wb_id}/{i}.jpg'} for i in range(photos)]
+        })
+
+    def test_fetch_new_feedbacks(self):
+        feedbacks = [
+            self.make_feedback('1', 100, photos=2),
+            self.make_feedback('2', 200),
+            self.make_feedback('3', 300),
+            self.make_feedback('4', 100, stars=5),
+        ]
+        with mock.patch.object(WBPersonalApiClient, 'get_feedbacks', return_value=(True, feedbacks)), \
+                mock.patch.object(tasks.send_feedback_notifications, 'apply_async') as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(tasks.fetch_new_feedbacks('supplier'), 2)
+            self.assertEqual(tasks.fetch_new_feedbacks('supplier'), 0)
+        self.assertEqual(apply_async.call_count, 1)
+        self.assertEqual(Feedback.objects.count(), 2)
+        self.assertEqual(FeedbackPhoto.objects.count(), 2)
+        self.assertEqual(FeedbackNotification.objects.filter(sent_at__isnull=True).count(), 2)
+
+    def test_fetch_errors_do_not_break_poll_cycle(self):
+        with mock.patch.object(WBPersonalApiClient, 'get_feedbacks', side_effect=ValueError('not JSON')):
+            self.assertEqual(tasks.fetch_new_feedbacks('supplier'), 0)
+        with mock.patch.object(tasks, 'acquire_lease', return_value='cycle'), mock.patch.object(tasks, 'chord') as chord:
+            self.assertEqual(tasks.send_new_feedback_notification(), 1)
+        callback = chord.return_value.call_args[0][0]
+        self.assertEqual([errback['task'] for errback in callback.options['link_error']], ['Release feedbacks poll cycle'])
+        with mock.patch.object(tasks, 'release_lease') as release_lease:
+            tasks.release_poll_cycle('cycle')
+        release_lease.assert_called_once_with(tasks.POLL_CYCLE_LEASE, 'cycle')
+
+    def test_send_feedback_notifications(self):
+        feedbacks = [self.make_feedback('1', 100), self.make_feedback('2', 200)]
+        with mock.patch.object(WBPersonalApiClient, 'get_feedbacks', return_value=(True, feedbacks)):
+            tasks.fetch_new_feedbacks('supplier')
+        with mock.patch.object(Feedback, 'send_notify', side_effect=[None, Exception('Too Many Requests')]):
+            self.assertEqual(tasks.send_feedback_notifications(), 1)
+        failed = FeedbackNotification.objects.get(sent_at__isnull=True)
+        self.assertEqual(failed.attempts, 1)
+        self.assertGreater(failed.next_attempt_at, timezone.now())
+        with mock.patch.object(Feedback, 'send_notify'):
+            self.assertEqual(tasks.send_feedback_notifications(), 0)
+
+    def test_send_feedback_notifications_digest(self):
+        TelegramUser.objects.filter(pk=self.personal.user.pk).update(digest_window=60, digest_max_size=2)
+        feedbacks = [self.make_feedback(str(i), 100) for i in range(3)]
+        with mock.patch.object(WBPersonalApiClient, 'get_feedbacks', return_value=(True, feedbacks)):
+            tasks.fetch_new_feedbacks('supplier')
+        with mock.patch.object(Feedback, 'send_notify') as send_notify, \
+                mock.patch.object(tasks.bot, 'notify_new_feedbacks_digest') as notify_digest:
+            self.assertEqual(tasks.send_feedback_notifications(), 0)
+            FeedbackNotification.objects.update(next_attempt_at=timezone.now())
+            self.assertEqual(tasks.send_feedback_notifications(), 3)
+        self.assertEqual(notify_digest.call_count, 1)
+        self.assertEqual(len(notify_digest.call_args[0][1]), 2)
+        self.assertEqual(send_notify.call_count, 1)
+
+    def test_digest_photo_groups(self):
+        feedbacks = [self.make_feedback('1', 100, photos=1), self.make_feedback('2', 200), self.make_feedback('3', 200, photos=10)]
+        with mock.patch.object(WBPersonalApiClient, 'get_feedbacks', return_value=(True, feedbacks)):
+            tasks.fetch_new_feedbacks('supplier')
+        user = self.personal.user
+        with mock.patch.object(TeleBot, 'send_photo') as send_photo, \
+                mock.patch.object(TeleBot, 'send_media_group', return_value=[]) as send_media_group, \
+                mock.patch.object(TeleBot, 'send_message'):
+            tasks.bot.notify_new_feedbacks_digest(user, list(Feedback.objects.filter(wb_id__in=['1', '2']).order_by('wb_id')))
+            self.assertEqual(send_photo.call_count, 1)
+            self.assertEqual(send_media_group.call_count, 0)
+            tasks.bot.notify_new_feedbacks_digest(user, list(Feedback.objects.order_by('wb_id')))
+        self.assertEqual([len(call[0][1]) for call in send_media_group.call_args_list], [5, 6])
+        self.assertEqual(send_photo.call_args[1]['caption'], '🏷 100 | A-100')
+        captions = [media.caption for call in send_media_group.call_args_list for media in call[0][1]]
+        self.assertEqual([caption for caption in captions if caption is not None], ['🏷 100 | A-100', '🏷 200 | A-200'])
+
+    def test_digest_max_size_zero(self):
+        TelegramUser.objects.filter(pk=self.personal.user.pk).update(digest_window=60, digest_max_size=0)
+        with mock.patch.object(WBPersonalApiClient, 'get_feedbacks', return_value=(True, [self.make_feedback('1', 100), self.make_feedback('2', 200)])):
+            tasks.fetch_new_feedbacks('supplier')
+        FeedbackNotification.objects.update(next_attempt_at=timezone.now())
+        with mock.patch.object(Feedback, 'send_notify') as send_notify:
+            self.assertEqual(tasks.send_feedback_notifications(), 2)
+        self.assertEqual(send_notify.call_count, 2)
+
+    def test_fetch_new_feedbacks_once_per_supplier(self):
+        user = TelegramUser.objects.create(user_id=2, WBToken='other token', notification_stars=5)
+        personal = user.personal_set.create(supplierId='supplier', oldId=1, name='ИП', full_name='ИП')
+        personal.trackedarticle_set.create(nmId='100', article='A-100')
+        feedbacks = [self.make_feedback('1', 100), self.make_feedback('2', 100, stars=5)]
+        with mock.patch.object(WBPersonalApiClient, 'get_feedbacks', return_value=(True, feedbacks)) as get_feedbacks:
+            self.assertEqual(tasks.fetch_new_feedbacks('supplier'), 3)
+        self.assertEqual(get_feedbacks.call_count, 1)
+        self.assertEqual(Feedback.objects.filter(article__personal=personal).count(), 2)
+
+    def test_expired_token_breaker(self):
+        user = self.personal.user
+        with mock.patch.object(WBPersonalApiClient, 'get_feedbacks', return_value=(False, 'Неверный ключ')) as get_feedbacks, \
+                mock.patch.object(tasks.bot, 'notify_token_expired') as notify_token_expired:
+            for _ in range(settings.WB_TOKEN_FAILURE_THRESHOLD + 1):
+                tasks.fetch_new_feedbacks('supplier')
+            self.assertEqual(get_feedbacks.call_count, settings.WB_TOKEN_FAILURE_THRESHOLD)
+            self.assertEqual(notify_token_expired.call_count, 1)
+            user.refresh_from_db()
+            self.assertTrue(user.token_expired_notified)
+            retry_at = user.token_retry_at
+            TelegramUser.objects.filter(pk=user.pk).update(token_retry_at=timezone.now())
+            tasks.fetch_new_feedbacks('supplier')
+            self.assertEqual(notify_token_expired.call_count, 1)
+        user.refresh_from_db()
+        self.assertGreater(user.token_retry_at - timezone.now(), retry_at - self.start_time)
+        user.set_WBToken('new token')
+        self.assertEqual(Personal.objects.pollable().count(), 1)
+
+    def test_connection_errors_keep_token_healthy(self):
+        with mock.patch.object(WBPersonalApiClient, 'get_feedbacks', return_value=(False, 'Ошибка подключения')):
+            for _ in range(settings.WB_TOKEN_FAILURE_THRESHOLD):
+                tasks.fetch_new_feedbacks('supplier')
+        self.personal.user.refresh_from_db()
+        self.assertEqual(self.personal.user.token_failures, 0)
+        TelegramUser.objects.filter(pk=self.personal.user.pk).update(unactive=True)
+        self.assertEqual(Personal.objects.pollable().count(), 0)
+
+    def test_pollable_personals(self):
+        silent = TelegramUser.objects.create(user_id=2, WBToken='token', notification=False)
+        silent.personal_set.create(supplierId='silent', oldId=2, name='ИП', full_name='ИП').trackedarticle_set.create(nmId='1', article='A-1')
+        empty = TelegramUser.objects.create(user_id=3, WBToken='token')
+        empty.personal_set.create(supplierId='empty', oldId=3, name='ИП', full_name='ИП')
+        TelegramUser.objects.create(user_id=4)
+        self.assertEqual(TelegramUser.objects.notifiable().count(), 2)
+        self.assertEqual(TelegramUser.objects.authorized().count(), 3)
+        self.assertEqual(list(Personal.objects.pollable().values_list('supplierId', flat=True)), ['supplier'])
+
+    def test_fetch_new_feedbacks_mixed_watermarks(self):
+        self.personal.last_feedback_date = parse_wb_date('2023-03-10T10:00:00Z')
+        self.personal.last_feedback_id = 'old'
+        self.personal.save()
+        user = TelegramUser.objects.create(user_id=2, WBToken='other token', notification_stars=5)
+        personal = user.personal_set.create(supplierId='supplier', oldId=1, name='ИП', full_name='ИП')
+        personal.trackedarticle_set.create(nmId='100', article='A-100')
+        newer = [self.make_feedback(str(i), 100, created_date='2023-03-11T10:00:00Z') for i in range(FEEDBACKS_PAGE_SIZE + 30)]
+        pages = [newer[:FEEDBACKS_PAGE_SIZE], newer[FEEDBACKS_PAGE_SIZE:] + [self.make_feedback('old', 100)]]
+        with mock.patch.object(WBPersonalApiClient, 'get_feedbacks', side_effect=[(True, page) for page in pages]) as get_feedbacks:
+            tasks.fetch_new_feedbacks('supplier')
+        self.assertEqual(get_feedbacks.call_count, 2)
+        self.assertEqual(Feedback.objects.filter(article__personal=self.personal).count(), FEEDBACKS_PAGE_SIZE + 30)
+        self.assertEqual(Feedback.objects.filter(article__personal=personal).count(), FEEDBACKS_PAGE_SIZE)
+
+    def test_get_new_feedbacks_pages_until_watermark(self):
+        since = parse_wb_date('2023-03-10T10:00:00Z')
+        pages = [
+            [self.make_feedback(str(i), 100, created_date='2023-03-11T10:00:00Z') for i in range(FEEDBACKS_PAGE_SIZE)],
+            [self.make_feedback('old', 100), self.make_feedback('older', 100, created_date='2023-03-09T10:00:00Z')],
+        ]
+        client = WBPersonalApiClient('supplier', 'token')
+        with mock.patch.object(WBPersonalApiClient, 'get_feedbacks', side_effect=[(True, page) for page in pages]) as get_feedbacks:
+            response = client.get_new_feedbacks(since)
+        self.assertEqual(get_feedbacks.call_count, 2)
+        self.assertEqual(len(response[1]), FEEDBACKS_PAGE_SIZE + 1)
+
+    def test_fetch_new_feedbacks_async(self):
+        self.personal.last_feedback_date = parse_wb_date('2023-03-10T10:00:00Z')
+        self.personal.last_feedback_id = 'old'
+        self.personal.save()
+        user = TelegramUser.objects.create(user_id=2, WBToken='other token')
+        personal = user.personal_set.create(supplierId='supplier', oldId=1, name='ИП', full_name='ИП')
+        personal.trackedarticle_set.create(nmId='200', article='A-200')
+        newer = [self.make_feedback(str(i), 100, created_date='2023-03-11T10:00:00Z') for i in range(FEEDBACKS_PAGE_SIZE + 30)]
+        pages = [newer[:FEEDBACKS_PAGE_SIZE], newer[FEEDBACKS_PAGE_SIZE:] + [self.make_feedback('old', 100)]]
+        responses = [(False, 'Неверный ключ')] + [(True, page) for page in pages]
+        with mock.patch.object(AsyncWBPersonalApiClient, 'get_feedbacks', side_effect=responses) as get_feedbacks:
+            self.assertEqual(tasks.fetch_new_feedbacks_async(['supplier']), [FEEDBACKS_PAGE_SIZE + 30])
+        self.assertEqual(get_feedbacks.call_count, 3)
+        self.personal.user.refresh_from_db()
+        self.assertEqual(self.personal.user.token_failures, 1)
+        user.refresh_from_db()
+        self.assertEqual(user.token_failures, 0)
+        self.personal.refresh_from_db()
+        self.assertEqual(self.personal.last_feedback_id, '0')
+
+
+class RetryDelayTestCase(TestCase):
+
+    def test_get_retry_delay(self):
+        self.assertIsNone(get_retry_delay(200))
+        self.assertIsNone(get_retry_delay(401))
+        self.assertEqual(get_retry_delay(429, '7'), 7)
+        self.assertEqual(get_retry_delay(429, '86400'), settings.WB_API_BACKOFF_MAX)
+        self.assertEqual(get_retry_delay(503, 'Wed, 21 Oct 2099 07:28:00 GMT'), settings.WB_API_BACKOFF_MAX)
+        for attempt in range(10):
+            delay = get_retry_delay(503, attempt=attempt)
+            limit = min(settings.WB_API_BACKOFF_MAX, settings.WB_API_BACKOFF_BASE * 2 ** attempt)
+            self.assertTrue(limit / 2 <= delay <= limit)
+
+    def test_no_backoff_after_last_attempt(self):
+        session = mock.Mock()
+        session.request.return_value = mock.Mock(status_code=503, headers={})
+        with mock.patch.object(tools, 'get_session', return_value=session), mock.patch.object(tools.time, 'sleep') as sleep:
+            response = WBPersonalApiClient('supplier').make_request('GET', 'https://example.com')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(session.request.call_count, settings.WB_API_MAX_ATTEMPTS)
+        self.assertEqual(sleep.call_count, settings.WB_API_MAX_ATTEMPTS - 1)
+
+
+class SendSchedulerTestCase(TestCase):
+
+    def test_retry_after_flood_limit(self):
+        flood = TelegramException('sendMessage', mock.Mock(), {'error_code': 429, 'description': 'Too Many Requests', 'parameters': {'retry_after': 1}})
+        send = mock.Mock(side_effect=[flood, 'message'])
+        scheduler = SendScheduler()
+        with mock.patch.object(scheduler.chat_bucket, 'block') as block, mock.patch.object(scheduler.bulk_bucket, 'block') as bulk_block:
+            self.assertEqual(scheduler.call(1, send, BULK), 'message')
+        self.assertEqual(send.call_count, 2)
+        block.assert_called_once_with(1, 1)
+        bulk_block.assert_called_once_with(BULK, 1)
+
+    def test_other_errors_are_raised(self):
+        blocked = TelegramException('sendMessage', mock.Mock(), {'error_code': 403, 'description': 'Forbidden'})
+        with self.assertRaises(TelegramException):
+            SendScheduler().call(1, mock.Mock(side_effect=blocked))
+
+
+class ImageCacheTestCase(TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = ImageCache(10)
+        cache.set('a', b'1234')
+        cache.set('b', b'1234')
+        cache.get('a')
+        cache.set('c', b'1234')
+        self.assertEqual(cache.get('a'), b'1234')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.size, 8)
+        cache.set('d', b'12345678901')
+        self.assertIsNone(cache.get('d'))
+
+
+class RenderCollageTestCase(TestCase):
+
+    def test_collage_is_bounded(self):
+        images = [Image.new('RGB', (900, 1200), 'red') for _ in range(10)]
+        collage = Image.open(io.BytesIO(render_collage(images, max_size=1280)))
+        self.assertEqual(collage.format, 'JPEG')
+        self.assertLessEqual(max(collage.size), 1280)
+
+
+class TelegramFileTestCase(TestCase):
+
+    def test_send_photo_reuses_file_id(self):
+        photo = BinaryPayload.from_bytes(b'photo', 'photo.jpg', 'image/jpeg')
+        message = mock.Mock(photo=[mock.Mock(file_id='small'), mock.Mock(file_id='large')])
+        with mock.patch.object(TeleBot, 'send_photo', return_value=message) as send_photo:
+            tasks.bot.send_photo(1, photo, 'caption')
+            tasks.bot.send_photo(2, photo, 'caption')
+        self.assertEqual(send_photo.call_args_list[0].args[1][0], 'photo.jpg')
+        self.assertIsInstance(send_photo.call_args_list[0].args[1][1], io.BytesIO)
+        self.assertEqual(send_photo.call_args_list[1].args[1], 'large')
+
+    def test_rejected_file_id_is_uploaded_again(self):
+        TelegramFile.objects.create(content_hash=TelegramFile.get_content_hash(BinaryPayload.from_bytes(b'photo'), TelegramFile.PHOTO), file_id='expired')
+        rejected = TelegramException('sendPhoto', mock.Mock(), {'error_code': 400, 'description': 'Bad Request: wrong file identifier'})
+        message = mock.Mock(photo=[mock.Mock(file_id='new')])
+        with mock.patch.object(TeleBot, 'send_photo', side_effect=[rejected, message]):
+            tasks.bot.send_photo(1, BinaryPayload.from_bytes(b'photo'), 'caption')
+        self.assertEqual(TelegramFile.objects.get().file_id, 'new')
+
+
+class BuildExcelTestCase(TestCase):
+
+    def test_write_only_layout(self):
+        payload = build_excel('Список', ['Артикул WB', 'Артикул продавца'], [[123, 'vendor-code']], 'test.xlsx', {1: 15})
+        sheet = openpyxl.load_workbook(payload.open()).active
+        self.assertEqual(str(sheet.merged_cells), 'A1:B1')
+        self.assertEqual(sheet['A2'].style, 'header')
+        self.assertEqual(sheet['A3'].value, 123)
+        self.assertIn('/catalog/123/', sheet['A3'].hyperlink.target)
+        self.assertEqual(sheet.column_dimensions['A'].width, 15)
+        self.assertEqual(sheet.column_dimensions['B'].width, len('Артикул продавца') + 10)
+
+
+class TrackedArticlesImportTestCase(TestCase):
+
+    def setUp(self):
+        self.start_time = timezone.now()
+        self.user = TelegramUser.objects.create(user_id=1, WBToken='token')
+        self.personal = self.user.personal_set.create(supplierId='supplier', oldId=1, name='ИП', full_name='ИП')
+        self.personal.trackedarticle_set.create(nmId='1', article='vendor-1')
+
+    def tearDown(self):
+        t = timezone.now() - self.start_time
+        print(f'{self.id()}: {t}')
+
+    def make_file(self, rows: list) -> BinaryPayload:
+        wb = openpyxl.Workbook()
+        sheet = wb.active
+        sheet.append(['Список'])
+        sheet.append(['Артикул WB'])
+        for row in rows:
+            sheet.append(row)
+        file_stream = io.BytesIO()
+        wb.save(file_stream)
+        return BinaryPayload(file_stream, 'test.xlsx')
+
+    def test_add_articles_to_track(self):
+        file = self.make_file([
+            [1, 'vendor-1', 'brand', None, None, None, None, 'да'],
+            [2, 'vendor-2', 'brand', None, None, None, None, 'Да'],
+            [3, 'vendor-3', 'brand']
+        ])
+        self.personal.card_set.create(nmId='2', vendor_code='catalog-2', brand='catalog brand')
+        added_articles = add_articles_to_track(self.personal, file)
+        self.assertEqual([(article.nmId, article.article, article.brand) for article in added_articles[1]], [('2', 'catalog-2', 'catalog brand')])
+        self.assertEqual(self.personal.trackedarticle_set.count(), 2)
+
+    def test_get_suppliers_upserts_personals(self):
+        suppliers = [SupplierRecord('supplier', 1, 'ИП Новое', 'ИП Новое'), SupplierRecord('other', 2, 'ООО', 'ООО')]
+        with mock.patch.object(WBPersonalApiClient, 'get_suppliers', return_value=(True, suppliers)):
+            get_suppliers(self.user)
+            personals = get_suppliers(self.user)[1]
+        self.assertEqual(sorted(personals.values_list('supplierId', 'name')), [('other', 'ООО'), ('supplier', 'ИП Новое')])
+        self.assertEqual(self.personal.trackedarticle_set.count(), 1)
+
+    def test_remove_articles_from_track(self):
+        other = self.user.personal_set.create(supplierId='other', oldId=2, name='ООО', full_name='ООО')
+        other.trackedarticle_set.create(nmId='2', article='vendor-2')
+        removed_articles = remove_articles_from_track(self.user, self.make_file([[1, 'vendor-1', 'да'], [2, 'vendor-2', 'да']]))
+        self.assertEqual(len(removed_articles[1]), 2)
+        self.assertEqual(other.trackedarticle_set.count(), 0)
+
+    def test_cards_excel_marks_tracked(self):
+        cards = [
+            CardRecord.from_wb({
+                'nmID': nmId, 'vendorCode': 'vendor-%i' % nmId, 'Бренд': 'brand', 'Предмет': 'subject', 'Цвет': [], 'size': [{'wbSize': '', 'skus': ['1']}],
+                'updateAt': '2023-03-01T12:00:%02iZ' % (nmId % 60)
+            })
+            for nmId in range(1, 101)
+        ]
+        with mock.patch.object(WBPersonalApiClient, 'get_updated_cards', return_value=(True, cards)):
+            file = get_personal_cards_excel(self.user, self.personal)
+        sheet = openpyxl.load_workbook(file[1].open()).active
+        nmIds = {sheet.cell(row=row, column=1).value: sheet.cell(row=row, column=8).value for row in range(3, 103)}
+        self.assertEqual(nmIds[1], 'Уже отслеживается')
+        self.assertIsNone(nmIds[2])
+
+    def test_not_excel(self):
+        self.assertFalse(add_articles_to_track(self.personal, BinaryPayload.from_bytes(b'text'))[0])
+
+
+class RefreshCardsTestCase(TestCase):
+
+    def setUp(self):
+        self.start_time = timezone.now()
+        user = TelegramUser.objects.create(user_id=1, WBToken='token')
+        self.personal = user.personal_set.create(supplierId='supplier', oldId=1, name='ИП', full_name='ИП')
+
+    def tearDown(self):
+        t = timezone.now() - self.start_time
+        print(f'{self.id()}: {t}')
+
+    def make_card(self, nmId: int, update_at: str, vendor_code: str = 'vendor') -> dict:
+        return {'nmID': nmId, 'vendorCode': vendor_code, 'Бренд': 'brand', 'Предмет': 'subject', 'Цвет': ['red'], 'size': [{'wbSize': '42', 'skus': ['1']}], 'updateAt': update_at}
+
+    def make_response(self, cards: list) -> mock.Mock:
+        return mock.Mock(status_code=200, content=json.dumps({'data': {'cards': cards}}).encode('utf-8'))
+
+    def test_get_cards_fetches_pages_concurrently(self):
+        total = CARDS_PAGE_SIZE * 2 + CARDS_PAGE_SIZE // 2
+
+        def get_cards_page(skip, search=''):
+            return True, [CardRecord.from_wb(self.make_card(nmId, '2023-03-01T00:00:00Z')) for nmId in range(skip, min(skip + CARDS_PAGE_SIZE, total))]
+
+        with mock.patch.object(WBPersonalApiClient, 'get_cards_page', side_effect=get_cards_page) as get_page:
+            cards = WBPersonalApiClient('supplier', 'token').get_cards()
+        self.assertEqual([card.nmId for card in cards[1]], [str(nmId) for nmId in range(total)])
+        # первая страница, окно из одной и окно из двух, последняя из которых лишняя
+        self.assertEqual(get_page.call_count, 4)
+
+    def test_refresh_stops_at_synced_cards(self):
+        first = [self.make_card(2, '2023-03-02T00:00:00Z'), self.make_card(1, '2023-03-01T00:00:00Z')]
+        with mock.patch.object(WBPersonalApiClient, 'make_request', side_effect=[self.make_response(first), self.make_response([])]):
+            self.personal.refresh_cards()
+        self.assertEqual(self.personal.card_set.count(), 2)
+        self.assertEqual(self.personal.cards_synced_at, parse_card_date('2023-03-02T00:00:00Z'))
+
+        second = [self.make_card(1, '2023-03-03T00:00:00Z', 'renamed'), *first]
+        with mock.patch.object(WBPersonalApiClient, 'make_request', side_effect=[self.make_response(second)]) as make_request:
+            self.personal.refresh_cards()
+        self.assertEqual(make_request.call_count, 1)
+        self.assertEqual(self.personal.card_set.count(), 2)
+        self.assertEqual(self.personal.card_set.get(nmId='1').vendor_code, 'renamed')
+        self.assertEqual(self.personal.cards_synced_at, parse_card_date('2023-03-03T00:00:00Z'))
+
+    def test_full_sync_removes_deleted_cards(self):
+        cards = [self.make_card(2, '2023-03-02T00:00:00Z'), self.make_card(1, '2023-03-01T00:00:00Z')]
+        with mock.patch.object(WBPersonalApiClient, 'make_request', side_effect=[self.make_response(cards)]):
+            self.personal.refresh_cards()
+        with mock.patch.object(WBPersonalApiClient, 'make_request', side_effect=[self.make_response(cards[:1])]):
+            self.personal.refresh_cards()
+        self.assertEqual(self.personal.card_set.count(), 2)
+        self.personal.cards_full_sync_at -= timedelta(seconds=settings.CARDS_FULL_SYNC_INTERVAL)
+        with mock.patch.object(WBPersonalApiClient, 'make_request', side_effect=[self.make_response(cards[:1])]):
+            self.personal.refresh_cards()
+        self.assertEqual(list(self.personal.card_set.values_list('nmId', flat=True)), ['2'])
+        self.assertGreater(self.personal.cards_full_sync_at, self.start_time)
+
+    def test_refresh_keeps_newest_duplicate(self):
+        cards = [self.make_card(1, '2023-03-02T00:00:00Z', 'renamed'), self.make_card(2, '2023-03-01T00:00:00Z'), self.make_card(1, '2023-03-01T00:00:00Z')]
+        with mock.patch.object(WBPersonalApiClient, 'make_request', side_effect=[self.make_response(cards), self.make_response([])]):
+            self.assertEqual(len(self.personal.refresh_cards()[1]), 2)
+        self.assertEqual(self.personal.card_set.get(nmId='1').vendor_code, 'renamed')
+
+
+class RecordsTestCase(TestCase):
+
+    def test_feedbacks_response_is_decoded_once(self):
+        body = {'data': {'feedbacks': [{
+            'id': 1, 'nmId': 100, 'text': 'Отзыв', 'productValuation': 5, 'createdDate': '2023-03-10T10:00:00Z',
+            'photoLinks': [{'miniSize': 'https://example.com/1.jpg', 'fullSize': 'https://example.com/1-full.jpg'}]
+        }]}}
+        response = mock.Mock(status_code=200, content=json.dumps(body).encode('utf-8'))
+        feedbacks = WBPersonalApiClient('supplier', 'token')._feedbacks_response(response)[1]
+        response.json.assert_not_called()
+        self.assertEqual((feedbacks[0].id, feedbacks[0].nmId, feedbacks[0].stars), ('1', '100', 5))
+        self.assertEqual(feedbacks[0].photos, ['https://example.com/1.jpg'])
+        self.assertFalse(hasattr(feedbacks[0], '__dict__'))
@@ -0,0 +1,154 @@
+# Асинхронный клиент WB для опроса большого количества кабинетов
+import asyncio
+import json
+
+import aiohttp
+from apps.bot.utils.constants import (CARDS_PAGE_SIZE, FEEDBACKS_MAX_PAGES,
+                                      FEEDBACKS_PAGE_SIZE)
+from apps.bot.utils.ratelimit import get_retry_delay, wb_api_limiter
+from apps.bot.utils.records import decode
+from apps.bot.utils.tools import (WBPersonalApiClient, get_supplier_tokens,
+                                  get_supplier_watermark)
+from django.conf import settings
+from loguru import logger
+
+
+class AsyncResponse:
+    """
+        Прочитанный ответ aiohttp с тем же интерфейсом, что и у requests.Response,
+        чтобы разбор ответов был общим с синхронным клиентом
+    """
+
+    def __init__(self, status_code: int, content: bytes, cookies: dict) -> None:
+        self.status_code = status_code
+        self.content = content
+        self.cookies = cookies
+
+    @property
+    def text(self) -> str:
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return decode(self)
+
+
+def get_async_session() -> aiohttp.ClientSession:
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=settings.WB_API_ASYNC_CONCURRENCY),
+        timeout=aiohttp.ClientTimeout(sock_connect=settings.WB_API_CONNECT_TIMEOUT, sock_read=settings.WB_API_READ_TIMEOUT),
+        cookie_jar=aiohttp.DummyCookieJar()
+    )
+
+
+class AsyncWBPersonalApiClient(WBPersonalApiClient):
+    def __init__(self, session: aiohttp.ClientSession, supplierId: str = None, WBToken: str = None) -> None:
+        self.session = session
+        super().__init__(supplierId, WBToken)
+
+    async def make_request(self, method: str, url: str, params: tuple = None, payload: dict = None):
+        response = False
+        for attempt in range(settings.WB_API_MAX_ATTEMPTS):
+            if self.WBToken is not None:
+                while True:
+                    delay = await asyncio.to_thread(wb_api_limiter.acquire, self.WBToken)
+                    if delay <= 0:
+                        break
+                    await asyncio.sleep(delay)
+            try:
+                async with self.session.request(
+                    method, url, params=[(key, str(value)) for key, value in params] if params is not None else None,
+                    headers=self.headers, data=json.dumps(payload) if payload is not None else None
+                ) as raw:
+                    response = AsyncResponse(
+                        raw.status, await raw.read(), {key: morsel.value for key, morsel in raw.cookies.items()}
+                    )
+                    retry_after = raw.headers.get('Retry-After')
+            except Exception as err:
+                logger.error(err, exc_info=True)
+                return False
+            delay = get_retry_delay(response.status_code, retry_after, attempt)
+            if delay is None or attempt == settings.WB_API_MAX_ATTEMPTS - 1:
+                return response
+            await asyncio.to_thread(self._backoff, response.status_code, delay, attempt)
+            if self.WBToken is None:
+                await asyncio.sleep(delay)
+        return response
+
+    async def get_suppliers(self):
+        return self._suppliers_response(await self.make_request(*self._suppliers_request()))
+
+    async def get_feedbacks(self, skip: int = 0, take: int = 50):
+        return self._feedbacks_response(await self.make_request(*self._feedbacks_request(skip, take)))
+
+    async def get_new_feedbacks(self, since=None, since_id: str = None):
+        feedbacks = []
+        for page in range(FEEDBACKS_MAX_PAGES):
+            response = await self.get_feedbacks(skip=page * FEEDBACKS_PAGE_SIZE, take=FEEDBACKS_PAGE_SIZE)
+            if response[0] is False:
+                return response
+            if self._collect_new_feedbacks(response[1], feedbacks, since, since_id):
+                return True, feedbacks
+        logger.warning('Feedbacks watermark not reached after %i pages (supplier: %s)' % (FEEDBACKS_MAX_PAGES, self.supplierId))
+        return True, feedbacks
+
+    async def get_cards_page(self, skip: int = 0, search: str = ''):
+        return self._cards_response(await self.make_request(*self._cards_request(skip, search)))
+
+    async def get_cards(self, search: str = ''):
+        page = await self.get_cards_page(0, search)
+        if page[0] is False:
+            return page
+        cards = list(page[1])
+        if len(cards) == 0:
+            return False, 'Артикул не найден'
+
+        window = 1
+        skip = CARDS_PAGE_SIZE
+        while len(page[1]) == CARDS_PAGE_SIZE:
+            pages = await asyncio.gather(*[
+                self.get_cards_page(offset, search) for offset in range(skip, skip + window * CARDS_PAGE_SIZE, CARDS_PAGE_SIZE)
+            ])
+            for page in pages:
+                if page[0] is False:
+                    return page
+                cards += page[1]
+                if len(page[1]) < CARDS_PAGE_SIZE:
+                    break
+            skip += window * CARDS_PAGE_SIZE
+            window = min(window * 2, settings.WB_API_CARDS_CONCURRENCY)
+        logger.success('Success getting cards, total cards: %i' % len(cards))
+        return True, cards
+
+
+async def get_suppliers_feedbacks(suppliers: list, concurrency: int = None) -> list:
+    """
+        Опрашивает продавцов конкурентно, не больше concurrency продавцов одновременно.
+        suppliers - списки кабинетов одного продавца с подгруженным user (select_related).
+        В базу ничего не пишет: состояние токенов по attempts записывает вызывающий
+        в своем потоке, чтобы соединения ORM не открывались в потоках asgiref
+
+        :return list: пары (ответ get_new_feedbacks, attempts) в порядке suppliers,
+            attempts - опробованные токены с их ответами [(token, response), ...]
+    """
+    semaphore = asyncio.Semaphore(concurrency or settings.WB_API_ASYNC_CONCURRENCY)
+
+    async with get_async_session() as session:
+        async def poll(personals):
+            async with semaphore:
+                since, since_id = get_supplier_watermark(personals)
+                response = False, 'Вы не авторизованы в кабинете Wildberries'
+                attempts = []
+                try:
+                    for token in get_supplier_tokens(personals):
+                        client = AsyncWBPersonalApiClient(session, personals[0].supplierId, token)
+                        response = await client.get_new_feedbacks(since, since_id)
+                        attempts.append((token, response))
+                        if response[0] or response[1] == 'Ошибка подключения':
+                            break
+                except Exception as err:
+                    # ошибка одного продавца (например, не JSON в ответе) не должна ронять всю пачку
+                    logger.exception('Error fetching feedbacks [%s]: %s' % (personals[0].supplierId, err))
+                    response = False, 'Ошибка подключения'
+                return response, attempts
+
+        return await asyncio.gather(*(poll(personals) for personals in suppliers))
@@ -0,0 +1,48 @@
+# Общие подключения к внешним сервисам
+from http.cookiejar import DefaultCookiePolicy
+
+import redis
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+_redis = None
+_session = None
+
+
+def get_session() -> requests.Session:
+    """
+        Общая для процесса сессия с пулом keep-alive соединений.
+        Создается лениво, чтобы каждый форкнутый воркер получил свой пул.
+        Куки ответов в сессии не сохраняются, так как она общая для всех пользователей
+    """
+    global _session
+    if _session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=settings.WB_API_POOL_SIZE,
+            pool_maxsize=settings.WB_API_POOL_SIZE,
+            max_retries=Retry(
+                total=settings.WB_API_RETRIES,
+                backoff_factor=0.5,
+                raise_on_status=False
+            )
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        _session = session
+    return _session
+
+
+def get_redis() -> redis.Redis:
+    """
+        Общий для процесса клиент Redis (тот же, что использует Celery как брокер)
+    """
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(
+            settings.CELERY_BROKER_URL, socket_connect_timeout=1, socket_timeout=1, decode_responses=True
+        )
+    return _redis
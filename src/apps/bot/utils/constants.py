@@ -4,3 +4,13 @@ from django.conf import settings
 ADMIN_USER_ID = settings.TELEGRAM_ADMIN_USER_ID
 SPREADSHEET_ID = settings.SPREADSHEET_ID
 PERSONAL_PAGES_ITEMS_PER_PAGE = 5
+FEEDBACKS_PAGE_SIZE = 50
+FEEDBACKS_MAX_PAGES = 20
+CARDS_PAGE_SIZE = 100
+FEEDBACK_RATE_SMOOTHING = 0.3
+DIGEST_FEEDBACK_TEXT_LENGTH = 300
+MESSAGE_MAX_LENGTH = 4096
+MEDIA_GROUP_MAX_SIZE = 10
+COLLAGE_MAX_SIZE = 1280
+COLLAGE_QUALITY = 85
+COLLAGE_BACKGROUND = (255, 255, 255)
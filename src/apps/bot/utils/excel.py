@@ -0,0 +1,93 @@
+# Потоковая выгрузка таблиц Excel
+import io
+
+import openpyxl
+from apps.bot.utils.payloads import XLSX_MIME_TYPE, BinaryPayload
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import (Alignment, Border, Color, Font, NamedStyle,
+                             PatternFill, Side)
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.cell_range import CellRange
+
+HEADER_STYLE = 'header'
+NMID_STYLE = 'nmid'
+
+
+class ColumnWidths:
+    """
+        Ширина столбцов по самому длинному значению (плюс plus_size),
+        считается по мере добавления строк, без повторного обхода листа
+    """
+
+    def __init__(self, plus_size: int = 10) -> None:
+        self.plus_size = plus_size
+        self.widths = {}
+
+    def update(self, values: list) -> None:
+        for column, value in enumerate(values, 1):
+            if value:
+                width = len(str(value)) + self.plus_size
+                if width > self.widths.get(column, 0):
+                    self.widths[column] = width
+
+
+def get_named_styles() -> list:
+    medium = Side(style='medium')
+    return [
+        NamedStyle(
+            HEADER_STYLE,
+            fill=PatternFill(start_color=Color('B1A0C7'), end_color=Color('B1A0C7'), fill_type='solid'),
+            font=Font(bold=True, size=12),
+            alignment=Alignment(horizontal='center', vertical='center', wrap_text=True),
+            border=Border(left=medium, right=medium, top=medium, bottom=medium)
+        ),
+        NamedStyle(NMID_STYLE, alignment=Alignment(horizontal='center'))
+    ]
+
+
+def get_nmid_url(nmId: int) -> str:
+    return f'https://www.wildberries.ru/catalog/{nmId}/detail.aspx?targetUrl=SP'
+
+
+def build_excel(title: str, headers: list, rows, file_name: str, fixed_widths: dict = None) -> BinaryPayload:
+    """
+        Таблица в режиме write-only: заголовок на всю ширину, шапка и строки rows,
+        первое значение каждой строки - nmId, он выводится ссылкой на товар.
+        В write-only ширины столбцов пишутся до первой строки, поэтому rows проходятся
+        один раз с подсчетом ширин, а ячейки создаются только при записи
+
+        :return BinaryPayload: xlsx
+    """
+    widths = ColumnWidths()
+    widths.update([title])
+    widths.update(headers)
+    values = []
+    for row in rows:
+        widths.update(row)
+        values.append(row)
+    widths.widths.update(fixed_widths or {})
+
+    wb = openpyxl.Workbook(write_only=True)
+    for style in get_named_styles():
+        wb.add_named_style(style)
+    sheet = wb.create_sheet('Sheet')
+    for column, width in widths.widths.items():
+        sheet.column_dimensions[get_column_letter(column)].width = width
+    sheet.merged_cells.add(CellRange(min_col=1, min_row=1, max_col=len(headers), max_row=1))
+
+    def header_cell(value):
+        cell = WriteOnlyCell(sheet, value)
+        cell.style = HEADER_STYLE
+        return cell
+
+    sheet.append([header_cell(title)] + [header_cell(None) for _ in headers[1:]])
+    sheet.append([header_cell(header) for header in headers])
+    for row in values:
+        cell = WriteOnlyCell(sheet, row[0])
+        cell.style = NMID_STYLE
+        cell.hyperlink = get_nmid_url(row[0])
+        sheet.append([cell, *row[1:]])
+
+    file_stream = io.BytesIO()
+    wb.save(file_stream)
+    return BinaryPayload(file_stream, file_name, XLSX_MIME_TYPE)
@@ -0,0 +1,141 @@
+# Загрузка фотографий отзывов в память с общим кэшем
+import hashlib
+import io
+import math
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from apps.bot.utils.connections import get_session
+from apps.bot.utils.constants import (COLLAGE_BACKGROUND, COLLAGE_MAX_SIZE,
+                                      COLLAGE_QUALITY)
+from django.conf import settings
+from loguru import logger
+from PIL import Image
+
+
+class ImageCache:
+    """
+        Потокобезопасный LRU кэш содержимого картинок по sha1 от url.
+        Суммарный размер ограничен max_bytes, при переполнении вытесняются
+        давно не использованные картинки
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(url: str) -> str:
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def get(self, url: str):
+        key = self._key(url)
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+            return data
+
+    def set(self, url: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        key = self._key(url)
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._items[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+image_cache = ImageCache(settings.IMAGE_CACHE_MAX_BYTES)
+
+
+def fetch_image(url: str) -> bytes:
+    """
+        Содержимое картинки из кэша или по сети через общий пул соединений
+    """
+    data = image_cache.get(url)
+    if data is None:
+        response = get_session().get(
+            url, timeout=(settings.WB_API_CONNECT_TIMEOUT, settings.WB_API_READ_TIMEOUT)
+        )
+        response.raise_for_status()
+        data = response.content
+        image_cache.set(url, data)
+    return data
+
+
+def _load_image(url: str, draft_size: tuple = None):
+    try:
+        image = Image.open(io.BytesIO(fetch_image(url)))
+        if draft_size is not None:
+            # JPEG декодируется сразу в уменьшенном масштабе (1/2, 1/4, 1/8)
+            image.draft('RGB', draft_size)
+        image.load()
+        return image
+    except Exception as err:
+        logger.error('Failed to load image %s: %s' % (url, err))
+        return None
+
+
+def fetch_images(urls: list, draft_size: tuple = None) -> list:
+    """
+        Параллельно загружает картинки и открывает их в PIL без записи на диск.
+        Картинки, которые не удалось загрузить, пропускаются.
+        draft_size - примерный нужный размер, JPEG не будут декодироваться в полном размере
+
+        :return list: PIL.Image в порядке urls
+    """
+    if len(urls) == 0:
+        return []
+    workers = min(len(urls), settings.IMAGE_FETCH_CONCURRENCY)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        images = list(executor.map(lambda url: _load_image(url, draft_size), urls))
+    return [image for image in images if image is not None]
+
+
+def get_collage_grid(count: int, max_size: int = COLLAGE_MAX_SIZE) -> tuple:
+    """
+        Сетка почти квадратная: столбцов ceil(sqrt(count)), ячейки делят max_size поровну
+
+        :return tuple: (columns, rows, cell_size)
+    """
+    columns = math.ceil(math.sqrt(count))
+    rows = math.ceil(count / columns)
+    return columns, rows, max_size // columns
+
+
+def render_collage(images: list, max_size: int = COLLAGE_MAX_SIZE, quality: int = COLLAGE_QUALITY) -> bytes:
+    """
+        Раскладывает картинки сеткой в холст не больше max_size x max_size,
+        каждая уменьшается до размеров ячейки с сохранением пропорций и центрируется.
+        Ячейки ужимаются до самой большой уменьшенной картинки, чтобы не было пустых полей
+
+        :return bytes: JPEG
+    """
+    columns, rows, cell = get_collage_grid(len(images), max_size)
+    thumbnails = []
+    for image in images:
+        image = image.convert('RGB')
+        image.thumbnail((cell, cell), Image.LANCZOS)
+        thumbnails.append(image)
+    cell_width = max(image.width for image in thumbnails)
+    cell_height = max(image.height for image in thumbnails)
+    collage = Image.new('RGB', (columns * cell_width, rows * cell_height), COLLAGE_BACKGROUND)
+    for i, image in enumerate(thumbnails):
+        x = (i % columns) * cell_width + (cell_width - image.width) // 2
+        y = (i // columns) * cell_height + (cell_height - image.height) // 2
+        collage.paste(image, (x, y))
+    file_stream = io.BytesIO()
+    collage.save(file_stream, 'JPEG', quality=quality, optimize=True)
+    return file_stream.getvalue()
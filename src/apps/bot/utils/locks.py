@@ -0,0 +1,99 @@
+# Распределенные блокировки (аренды) в Redis
+import threading
+import uuid
+
+from apps.bot.utils.connections import get_redis
+from loguru import logger
+
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def _key(name: str) -> str:
+    return 'lease:%s' % name
+
+
+def acquire_lease(name: str, ttl: int):
+    """
+        Берет аренду на ttl секунд. Если Redis недоступен - аренда считается взятой,
+        чтобы опрос не останавливался
+
+        :return str: токен аренды, None если аренду держит кто-то другой
+    """
+    token = uuid.uuid4().hex
+    try:
+        if get_redis().set(_key(name), token, nx=True, px=int(ttl * 1000)):
+            return token
+        return None
+    except Exception as err:
+        logger.error('Lease storage unavailable: %s' % err)
+        return token
+
+
+def renew_lease(name: str, token: str, ttl: int) -> bool:
+    try:
+        return bool(get_redis().eval(RENEW_SCRIPT, 1, _key(name), token, int(ttl * 1000)))
+    except Exception as err:
+        logger.error('Lease storage unavailable: %s' % err)
+        return False
+
+
+def release_lease(name: str, token: str) -> bool:
+    try:
+        return bool(get_redis().eval(RELEASE_SCRIPT, 1, _key(name), token))
+    except Exception as err:
+        logger.error('Lease storage unavailable: %s' % err)
+        return False
+
+
+class RedisLeases:
+    """
+        Контекстный менеджер: берет те аренды из names, которые свободны,
+        продлевает их в фоне каждые ttl/3 секунд и отпускает на выходе.
+        Взятые имена доступны в acquired
+    """
+
+    def __init__(self, names: list, ttl: int) -> None:
+        self.names = list(names)
+        self.ttl = ttl
+        self.tokens = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def acquired(self) -> list:
+        return list(self.tokens)
+
+    def _renew(self) -> None:
+        while not self._stop.wait(self.ttl / 3):
+            for name, token in list(self.tokens.items()):
+                if not renew_lease(name, token, self.ttl):
+                    logger.warning('Lease %s lost before release' % name)
+
+    def __enter__(self):
+        for name in self.names:
+            token = acquire_lease(name, self.ttl)
+            if token is not None:
+                self.tokens[name] = token
+        if len(self.tokens) != 0:
+            self._thread = threading.Thread(target=self._renew, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        for name, token in self.tokens.items():
+            release_lease(name, token)
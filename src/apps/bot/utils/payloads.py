@@ -0,0 +1,44 @@
+# Двоичные файлы, которые tools передают боту для отправки
+import io
+from pathlib import Path
+
+XLSX_MIME_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+JPEG_MIME_TYPE = 'image/jpeg'
+
+
+class BinaryPayload:
+    """
+        Файл в памяти с именем и mime типом. Буфер передается в Telegram как есть,
+        без копирования в bytes и base64
+    """
+    __slots__ = ('buffer', 'file_name', 'mime_type')
+
+    def __init__(self, buffer: io.BytesIO, file_name: str = None, mime_type: str = None) -> None:
+        self.buffer = buffer
+        self.file_name = file_name
+        self.mime_type = mime_type
+
+    @classmethod
+    def from_bytes(cls, data: bytes, file_name: str = None, mime_type: str = None):
+        return cls(io.BytesIO(data), file_name, mime_type)
+
+    @classmethod
+    def from_path(cls, path: Path, mime_type: str = None):
+        with open(path, 'rb') as f:
+            return cls(io.BytesIO(f.read()), Path(path).name, mime_type)
+
+    def open(self) -> io.BytesIO:
+        """
+            Буфер с начала. Вызывается на каждую попытку отправки
+        """
+        self.buffer.seek(0)
+        return self.buffer
+
+    def getbuffer(self) -> memoryview:
+        return self.buffer.getbuffer()
+
+    def as_upload(self, file_name: str = None) -> tuple:
+        """
+            Файл в виде (имя, поток, mime тип), как его принимает multipart в requests
+        """
+        return file_name or self.file_name, self.open(), self.mime_type
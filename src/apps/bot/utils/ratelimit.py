@@ -0,0 +1,128 @@
+# Ограничение частоты запросов, общее для всех воркеров через Redis
+import hashlib
+import random
+import time
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+
+from apps.bot.utils.connections import get_redis
+from django.conf import settings
+from loguru import logger
+
+ACQUIRE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local ttl = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts', 'blocked_until')
+local tokens = tonumber(data[1]) or burst
+local ts = tonumber(data[2]) or now
+local blocked_until = tonumber(data[3]) or 0
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if blocked_until > now then
+    wait = blocked_until - now
+elseif tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now), 'blocked_until', tostring(blocked_until))
+redis.call('EXPIRE', KEYS[1], ttl)
+return tostring(wait)
+"""
+
+BLOCK_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local blocked_until = math.max(tonumber(redis.call('HGET', KEYS[1], 'blocked_until')) or 0, now + tonumber(ARGV[1]))
+redis.call('HSET', KEYS[1], 'blocked_until', tostring(blocked_until))
+redis.call('EXPIRE', KEYS[1], math.ceil(blocked_until - now) + tonumber(ARGV[2]))
+return tostring(blocked_until)
+"""
+
+
+class TokenBucket:
+    """
+        Token bucket в Redis: rate токенов в секунду, не больше burst подряд.
+        block() запрещает запросы по ключу до указанного момента (Retry-After, backoff).
+        Если Redis недоступен - ограничение не применяется, чтобы не остановить опрос
+    """
+
+    def __init__(self, prefix: str, rate: float, burst: int, ttl: int = 3600) -> None:
+        self.prefix = prefix
+        self.rate = rate
+        self.burst = burst
+        self.ttl = ttl
+
+    def _key(self, key: str) -> str:
+        return '%s:%s' % (self.prefix, hashlib.sha1(str(key).encode('utf-8')).hexdigest())
+
+    def acquire(self, key: str) -> float:
+        """
+            Пытается взять токен
+
+            :return float: 0 если токен получен, иначе сколько секунд подождать
+        """
+        try:
+            return float(get_redis().eval(ACQUIRE_SCRIPT, 1, self._key(key), self.rate, self.burst, self.ttl))
+        except Exception as err:
+            logger.error('Rate limiter unavailable: %s' % err)
+            return 0
+
+    def wait(self, key: str) -> None:
+        while True:
+            delay = self.acquire(key)
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def block(self, key: str, seconds: float) -> None:
+        try:
+            get_redis().eval(BLOCK_SCRIPT, 1, self._key(key), seconds, self.ttl)
+        except Exception as err:
+            logger.error('Rate limiter unavailable: %s' % err)
+
+    def state(self, key: str) -> dict:
+        """
+            Текущее состояние ключа: доступные токены (без учета пополнения с момента
+            последнего запроса), время последнего запроса и момент, до которого запросы запрещены
+        """
+        data = get_redis().hgetall(self._key(key))
+        return {
+            'tokens': float(data.get('tokens', self.burst)),
+            'last_request_at': datetime.fromtimestamp(float(data['ts'])) if 'ts' in data else None,
+            'next_allowed_at': datetime.fromtimestamp(float(data['blocked_until'])) if float(data.get('blocked_until', 0)) > time.time() else None
+        }
+
+
+wb_api_limiter = TokenBucket('ratelimit:wb', settings.WB_API_RATE, settings.WB_API_BURST)
+
+
+def is_retryable(status_code: int) -> bool:
+    """
+        Ответ WB, который означает перегрузку или сбой на его стороне, а не ошибку запроса
+    """
+    return status_code == 429 or status_code >= 500
+
+
+def get_retry_delay(status_code: int, retry_after: str = None, attempt: int = 0):
+    """
+        Сколько ждать перед повтором запроса к WB, не больше WB_API_BACKOFF_MAX
+
+        :return float: секунды, None если запрос повторять не нужно
+    """
+    if not is_retryable(status_code):
+        return None
+    if retry_after:
+        try:
+            return min(settings.WB_API_BACKOFF_MAX, max(0, float(retry_after)))
+        except ValueError:
+            try:
+                delay = (parsedate_to_datetime(retry_after) - datetime.now().astimezone()).total_seconds()
+                return min(settings.WB_API_BACKOFF_MAX, max(0, delay))
+            except (TypeError, ValueError):
+                pass
+    delay = min(settings.WB_API_BACKOFF_MAX, settings.WB_API_BACKOFF_BASE * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
@@ -0,0 +1,99 @@
+# Разбор ответов WB в компактные записи с нужными полями
+import json
+from datetime import datetime, timedelta
+
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+
+def decode(response) -> object:
+    """
+        Тело ответа, разобранное один раз
+    """
+    return loads(response.content)
+
+
+def parse_wb_date(value: str) -> datetime:
+    # fromisoformat в разы быстрее strptime, а дат на больших страницах тысячи
+    return timezone.make_aware(datetime.fromisoformat(value.rstrip('Z')) + timedelta(hours=3))
+
+
+def parse_card_date(value: str):
+    if not value:
+        return None
+    date = parse_datetime(value)
+    if date is not None and timezone.is_naive(date):
+        date = timezone.make_aware(date)
+    return date
+
+
+class FeedbackRecord:
+    __slots__ = ('id', 'nmId', 'text', 'stars', 'created_date', 'photos')
+
+    def __init__(self, id: str, nmId: str, text: str, stars: int, created_date: datetime, photos: list) -> None:
+        self.id = id
+        self.nmId = nmId
+        self.text = text
+        self.stars = stars
+        self.created_date = created_date
+        self.photos = photos
+
+    @classmethod
+    def from_wb(cls, data: dict):
+        return cls(
+            str(data['id']),
+            str(data['nmId']),
+            data.get('text') or '',
+            data['productValuation'],
+            parse_wb_date(data['createdDate']),
+            [photo['miniSize'] for photo in data.get('photoLinks') or []]
+        )
+
+
+class CardRecord:
+    __slots__ = ('nmId', 'vendor_code', 'brand', 'subject', 'color', 'size', 'barcode', 'updated_at')
+
+    def __init__(self, nmId: str, vendor_code: str, brand: str, subject: str, color: str, size: str,
+                 barcode: str, updated_at: datetime = None) -> None:
+        self.nmId = nmId
+        self.vendor_code = vendor_code
+        self.brand = brand
+        self.subject = subject
+        self.color = color
+        self.size = size
+        self.barcode = barcode
+        self.updated_at = updated_at
+
+    @classmethod
+    def from_wb(cls, data: dict):
+        size = data.get('size') or [{}]
+        return cls(
+            str(data['nmID']),
+            data.get('vendorCode') or '',
+            data.get('Бренд') or '',
+            data.get('Предмет') or '',
+            ', '.join(data.get('Цвет') or []),
+            size[0].get('wbSize') or '',
+            (size[0].get('skus') or [''])[0],
+            parse_card_date(data.get('updateAt'))
+        )
+
+
+class SupplierRecord:
+    __slots__ = ('id', 'old_id', 'name', 'full_name')
+
+    def __init__(self, id: str, old_id: int, name: str, full_name: str) -> None:
+        self.id = id
+        self.old_id = old_id
+        self.name = name
+        self.full_name = full_name
+
+    @classmethod
+    def from_wb(cls, data: dict):
+        return cls(data['id'], data['oldID'], data['name'], data['fullName'])
@@ -0,0 +1,48 @@
+# Планировщик отправки сообщений с учетом лимитов Telegram Bot API
+from typing import Callable
+
+from apps.bot.utils.ratelimit import TokenBucket
+from django.conf import settings
+from loguru import logger
+from telebot.apihelper import ApiTelegramException as TelegramException
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+
+
+class SendScheduler:
+    """
+        Общий для бота и воркеров планировщик отправки через Redis:
+        - общий лимит на бота (TELEGRAM_GLOBAL_RATE сообщений в секунду);
+        - лимит на чат (TELEGRAM_CHAT_RATE в секунду, до TELEGRAM_CHAT_BURST подряд),
+          отправки в один чат ждут своей очереди в его bucket;
+        - массовые рассылки (BULK) дополнительно ограничены TELEGRAM_BULK_RATE,
+          так что ответам пользователям (INTERACTIVE) всегда остается запас общего лимита.
+        На 429 ждет retry_after из ответа Telegram и повторяет отправку
+    """
+
+    def __init__(self) -> None:
+        self.global_bucket = TokenBucket('ratelimit:tg:global', settings.TELEGRAM_GLOBAL_RATE, settings.TELEGRAM_GLOBAL_RATE)
+        self.bulk_bucket = TokenBucket('ratelimit:tg:bulk', settings.TELEGRAM_BULK_RATE, settings.TELEGRAM_BULK_RATE)
+        self.chat_bucket = TokenBucket('ratelimit:tg:chat', settings.TELEGRAM_CHAT_RATE, settings.TELEGRAM_CHAT_BURST)
+
+    def call(self, chat_id: int, send: Callable, priority: str = INTERACTIVE):
+        """
+            Вызывает send() когда лимиты позволяют отправить сообщение в chat_id.
+            send вызывается заново на каждую попытку, поэтому файлы должны открываться внутри него
+        """
+        for attempt in range(settings.TELEGRAM_SEND_MAX_ATTEMPTS):
+            self.chat_bucket.wait(chat_id)
+            if priority == BULK:
+                self.bulk_bucket.wait(BULK)
+            self.global_bucket.wait(INTERACTIVE)
+            try:
+                return send()
+            except TelegramException as err:
+                if err.error_code != 429 or attempt == settings.TELEGRAM_SEND_MAX_ATTEMPTS - 1:
+                    raise
+                retry_after = (err.result_json or {}).get('parameters', {}).get('retry_after', 1)
+                logger.warning('Telegram flood limit for chat %s, retry in %ss (%s)' % (chat_id, retry_after, priority))
+                self.chat_bucket.block(chat_id, retry_after)
+                if priority == BULK:
+                    self.bulk_bucket.block(BULK, retry_after)
@@ -1,21 +1,28 @@
 # Пропишите функции для ботов здесь
-import base64
-import io
 import json
 import os
-import uuid
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
 import httplib2
 import openpyxl
-import requests
 from apps.bot.models import TelegramUser
-from apps.bot.utils.constants import SPREADSHEET_ID
+from apps.bot.utils.connections import get_session
+from apps.bot.utils.constants import (CARDS_PAGE_SIZE, FEEDBACKS_MAX_PAGES,
+                                      FEEDBACKS_PAGE_SIZE, SPREADSHEET_ID)
+from apps.bot.utils.excel import build_excel
+from apps.bot.utils.images import (fetch_images, get_collage_grid,
+                                   render_collage)
+from apps.bot.utils.payloads import JPEG_MIME_TYPE, BinaryPayload
+from apps.bot.utils.ratelimit import (get_retry_delay, is_retryable,
+                                      wb_api_limiter)
+from apps.bot.utils.records import (CardRecord, FeedbackRecord, SupplierRecord,
+                                    decode)
 from django.conf import settings
 from googleapiclient.discovery import build
 from loguru import logger
 from oauth2client.service_account import ServiceAccountCredentials
-from openpyxl.styles import Alignment, Border, Color, Font, PatternFill, Side
-from PIL import Image
 
 logger.add('logs/bot_tools.log')
 
@@ -25,6 +32,7 @@ class WBPersonalApiClient:
         self.supplierId = supplierId
         self.WBToken = WBToken
         self.base_url = 'https://seller.wildberries.ru/'
+        self.headers = self._headers()
 
     def _headers(self):
         return {
@@ -38,11 +46,35 @@ class WBPersonalApiClient:
         }
 
     def make_request(self, method: str, url: str, params: tuple = None, payload: dict = None):
-        try:
-            return requests.request(method, url=url, params=params, headers=self._headers(), data=json.dumps(payload) if payload is not None else None)
-        except Exception as err:
-            logger.error(err, exc_info=True)
-            return False
+        """
+            Запрос к WB с ограничением частоты по WBToken.
+            На 429 и 5xx ждет Retry-After или экспоненциальную паузу и повторяет запрос.
+            После последней попытки не ждет и сразу возвращает ответ
+        """
+        response = False
+        for attempt in range(settings.WB_API_MAX_ATTEMPTS):
+            if self.WBToken is not None:
+                wb_api_limiter.wait(self.WBToken)
+            try:
+                response = get_session().request(
+                    method, url=url, params=params, headers=self.headers, data=json.dumps(payload) if payload is not None else None,
+                    timeout=(settings.WB_API_CONNECT_TIMEOUT, settings.WB_API_READ_TIMEOUT)
+                )
+            except Exception as err:
+                logger.error(err, exc_info=True)
+                return False
+            delay = get_retry_delay(response.status_code, response.headers.get('Retry-After'), attempt)
+            if delay is None or attempt == settings.WB_API_MAX_ATTEMPTS - 1:
+                return response
+            self._backoff(response.status_code, delay, attempt)
+            if self.WBToken is None:
+                time.sleep(delay)
+        return response
+
+    def _backoff(self, status_code: int, delay: float, attempt: int):
+        logger.warning('WB API responded %i, retry in %.1fs (attempt %i, supplier: %s)' % (status_code, delay, attempt + 1, self.supplierId))
+        if self.WBToken is not None:
+            wb_api_limiter.block(self.WBToken, delay)
 
     def _check_api(self):
         pass
@@ -63,7 +95,7 @@ class WBPersonalApiClient:
 
         if response.status_code == 200:
             logger.success('Success send verify code to %s' % phone)
-            return True, response.json()
+            return True, decode(response)
         logger.error('Error sending verify code %i\n[RESPONSE TEXT]: %s\n[RESPONSE PAYLOAD]: %s' % (response.status_code, response.text, payload))
         return False, 'Неверный номер телефона'
 
@@ -89,14 +121,15 @@ class WBPersonalApiClient:
             return True, {
                 'WBToken': response.cookies['WBToken']
             }
-        if response.json().get('error', '') == 'invalid_token':
+        error = decode(response).get('error', '')
+        if error == 'invalid_token':
             return False, 'Неверный токен'
-        elif response.json().get('error', '') == 'invalid_code':
+        elif error == 'invalid_code':
             return False, 'Неверный код подтверждения'
-        logger.error('Error verify code %s' % response.json().get('error', ''))
-        return False, response.json().get('error', '')
+        logger.error('Error verify code %s' % error)
+        return False, error
 
-    def get_suppliers(self):
+    def _suppliers_request(self):
         url = self.base_url + 'ns/suppliers/suppliers-portal-core/suppliers'
 
         payload = [
@@ -107,19 +140,23 @@ class WBPersonalApiClient:
                 'jsonrpc': '2.0'
             }
         ]
-        response = self.make_request(
-            'POST', url=url, payload=payload
-        )
+        return 'POST', url, None, payload
+
+    def _suppliers_response(self, response):
         if response is False:
             return False, 'Ошибка подключения'
 
         if response.status_code == 200:
-            logger.success('Success get suppliers by token, total suppliers: %i' % len(response.json()[0]['result']['suppliers']))
-            return True, response.json()[0]['result']['suppliers']
+            suppliers = [SupplierRecord.from_wb(supplier) for supplier in decode(response)[0]['result']['suppliers']]
+            logger.success('Success get suppliers by token, total suppliers: %i' % len(suppliers))
+            return True, suppliers
         logger.error('Error getting suppliers: %s' % response.text)
         return False, 'Не удалось получить продавцов кабинета Wildberries'
 
-    def get_feedbacks(self, skip: int = 0, take: int = 50):
+    def get_suppliers(self):
+        return self._suppliers_response(self.make_request(*self._suppliers_request()))
+
+    def _feedbacks_request(self, skip: int = 0, take: int = 50):
         url = self.base_url + 'ns/api/suppliers-portal-feedbacks-questions/api/v1/feedbacks'
         params = (
             ('isAnswered', False, ),
@@ -128,88 +165,222 @@ class WBPersonalApiClient:
             ('skip', skip, ),
             ('take', take, ),
         )
+        return 'GET', url, params, None
 
-        response = self.make_request(
-            'GET', url=url, params=params
-        )
+    def _feedbacks_response(self, response):
         if response is False:
             return False, 'Ошибка подключения'
 
         if response.status_code == 200:
-            logger.success('Success getting feedbacks, total feedbacks: %i' % len(response.json().get('data', {}).get('feedbacks', [])))
-            return True, response.json().get('data', {}).get('feedbacks', [])
+            feedbacks = [FeedbackRecord.from_wb(feedback) for feedback in decode(response).get('data', {}).get('feedbacks', [])]
+            logger.success('Success getting feedbacks, total feedbacks: %i' % len(feedbacks))
+            return True, feedbacks
+        if is_retryable(response.status_code):
+            # WB так и не ответил после повторов, токен тут ни при чем
+            logger.error('WB unavailable get feedbacks %i' % response.status_code)
+            return False, 'Ошибка подключения'
         logger.error('Invalid key get feedbacks %s' % response.text)
         return False, 'Неверный ключ'
 
-    def get_cards(self, search: str = ''):
+    def get_feedbacks(self, skip: int = 0, take: int = 50):
+        return self._feedbacks_response(self.make_request(*self._feedbacks_request(skip, take)))
+
+    def _collect_new_feedbacks(self, page: list, feedbacks: list, since: datetime = None, since_id: str = None) -> bool:
+        """
+            Добавляет в feedbacks отзывы страницы новее отметки
+
+            :return bool: дошли ли до уже полученных отзывов
+        """
+        if since is None and since_id is None:
+            feedbacks += page
+            return True
+        new = filter_new_feedbacks(page, since, since_id)
+        feedbacks += new
+        return len(new) < len(page) or len(page) < FEEDBACKS_PAGE_SIZE
+
+    def get_new_feedbacks(self, since: datetime = None, since_id: str = None):
+        """
+            Листает отзывы от новых к старым, пока не дойдет до уже полученных.
+            Без since возвращает только первую страницу.
+            Если любая страница не загрузилась - возвращает ошибку целиком,
+            чтобы отметка последнего отзыва не сдвинулась через пропущенные страницы
+        """
+        feedbacks = []
+        for page in range(FEEDBACKS_MAX_PAGES):
+            response = self.get_feedbacks(skip=page * FEEDBACKS_PAGE_SIZE, take=FEEDBACKS_PAGE_SIZE)
+            if response[0] is False:
+                return response
+            if self._collect_new_feedbacks(response[1], feedbacks, since, since_id):
+                return True, feedbacks
+        logger.warning('Feedbacks watermark not reached after %i pages (supplier: %s)' % (FEEDBACKS_MAX_PAGES, self.supplierId))
+        return True, feedbacks
+
+    def _cards_request(self, skip: int = 0, search: str = ''):
         url = self.base_url + 'ns/viewer/content-card/viewer/tableList'
-
-        offset = 100
-
-        def get_page(skip=0):
-            payload = {
-                'sort': {
-                    'limit': offset,
-                    'offset': skip,
-                    'searchValue': search,
-                    'sortColumn': 'updateAt',
-                    'ascending': False
-                },
-                'filter': {
-                    'tags': [],
-                    'brands': [],
-                    'subjects': [],
-                    'hasPhoto': 0
-                }
+        payload = {
+            'sort': {
+                'limit': CARDS_PAGE_SIZE,
+                'offset': skip,
+                'searchValue': search,
+                'sortColumn': 'updateAt',
+                'ascending': False
+            },
+            'filter': {
+                'tags': [],
+                'brands': [],
+                'subjects': [],
+                'hasPhoto': 0
             }
-            response = self.make_request(
-                'POST', url=url, payload=payload
-            )
-            return response
+        }
+        return 'POST', url, None, payload
 
-        response = get_page()
+    def _cards_response(self, response):
         if response is False:
             return False, 'Ошибка подключения'
+        if response.status_code != 200:
+            logger.error('Invalid key get cards %s' % response.status_code)
+            return False, 'Неверный ключ'
+        return True, [CardRecord.from_wb(card) for card in decode(response).get('data', {}).get('cards', [])]
+
+    def get_cards_page(self, skip: int = 0, search: str = ''):
+        return self._cards_response(self.make_request(*self._cards_request(skip, search)))
+
+    def iter_cards_pages(self, search: str = ''):
+        """
+            Страницы карточек по порядку. Первая запрашивается одна, следующие - окнами
+            параллельно (частоту запросов к WB ограничивает make_request), пока не придет
+            неполная страница. Окно растет 1, 2, 4... до WB_API_CARDS_CONCURRENCY, чтобы
+            у небольших кабинетов не запрашивать лишних страниц за последней
+
+            :return generator: ответы get_cards_page, после ошибки страниц больше нет
+        """
+        page = self.get_cards_page(0, search)
+        yield page
+        if page[0] is False or len(page[1]) < CARDS_PAGE_SIZE:
+            return
+        window = 1
+        skip = CARDS_PAGE_SIZE
+        with ThreadPoolExecutor(max_workers=settings.WB_API_CARDS_CONCURRENCY) as executor:
+            while True:
+                offsets = range(skip, skip + window * CARDS_PAGE_SIZE, CARDS_PAGE_SIZE)
+                for page in executor.map(lambda offset: self.get_cards_page(offset, search), offsets):
+                    yield page
+                    if page[0] is False or len(page[1]) < CARDS_PAGE_SIZE:
+                        return
+                skip += window * CARDS_PAGE_SIZE
+                window = min(window * 2, settings.WB_API_CARDS_CONCURRENCY)
 
+    def get_cards(self, search: str = ''):
         cards = []
-        batch = response.json()
-        if len(batch.get('data', {}).get('cards', [])) == 0:
+        for page in self.iter_cards_pages(search):
+            if page[0] is False:
+                return page
+            cards += page[1]
+        if len(cards) == 0:
             return False, 'Артикул не найден'
-        cards += batch.get('data', {}).get('cards', [])
-
-        attempt = 1
-        while True:
-            response = get_page(offset*attempt)
-            attempt += 1
-            if response is False:
-                return False, 'Ошибка подключения'
-            if response.status_code == 200:
-                logger.success('Success getting cards, total cards: %i, attempt: %i' % (len(cards), attempt))
-                if len(response.json().get('data', {}).get('cards', [])) == 0:
-                    break
-                cards += response.json().get('data', {}).get('cards')
-            else:
-                logger.error('Invalid key get cards %s' % response.status_code)
-                return False, 'Неверный ключ'
+        logger.success('Success getting cards, total cards: %i' % len(cards))
+        return True, cards
+
+    def get_updated_cards(self, since: datetime = None):
+        """
+            Карточки от недавно измененных к старым (по updateAt), пока не дойдет
+            до измененных раньше since. Без since - все карточки кабинета
+        """
+        cards = []
+        for page in self.iter_cards_pages():
+            if page[0] is False:
+                return page
+            for card in page[1]:
+                if since is not None and card.updated_at is not None and card.updated_at < since:
+                    return True, cards
+                cards.append(card)
         return True, cards
 
 
+def filter_new_feedbacks(feedbacks: list, since: datetime = None, since_id: str = None) -> list:
+    """
+        Отзывы (от новых к старым) до отметки since/since_id.
+        Без отметки - только первая страница, как при первом опросе кабинета
+    """
+    if since is None and since_id is None:
+        return feedbacks[:FEEDBACKS_PAGE_SIZE]
+    new = []
+    for feedback in feedbacks:
+        if feedback.id == since_id or (since is not None and feedback.created_date < since):
+            break
+        new.append(feedback)
+    return new
+
+
+def get_supplier_watermark(personals: list) -> tuple:
+    """
+        Общая отметка для опроса кабинетов одного продавца: самая старая из отметок кабинетов,
+        чтобы ни один из них не пропустил отзывы. Кабинеты без отметки не учитываются,
+        им filter_new_feedbacks оставит только первую страницу. Если отметки нет ни у одного - (None, None)
+    """
+    watermarked = [personal for personal in personals if personal.last_feedback_date is not None]
+    if len(watermarked) == 0:
+        return None, None
+    oldest = min(watermarked, key=lambda personal: personal.last_feedback_date)
+    return oldest.last_feedback_date, oldest.last_feedback_id
+
+
+def get_supplier_tokens(personals: list) -> list:
+    tokens = []
+    for personal in personals:
+        if personal.user.WBToken is not None and personal.user.WBToken not in tokens:
+            tokens.append(personal.user.WBToken)
+    return tokens
+
+
+def record_token_result(personals: list, token: str, response: tuple) -> None:
+    """
+        Отмечает успех или отказ WB по токену у пользователей кабинетов с этим токеном.
+        Ошибки подключения состояние токена не меняют
+    """
+    if response[0] is False and response[1] != 'Неверный ключ':
+        return
+    users = {personal.user.pk: personal.user for personal in personals if personal.user.WBToken == token}
+    for user in users.values():
+        if response[0]:
+            user.record_token_success()
+        else:
+            user.record_token_failure()
+            logger.warning('WBToken rejected [user: %s, failures: %i]' % (user.pk, user.token_failures))
+
+
+def get_supplier_feedbacks(personals: list):
+    """
+        Получает новые отзывы продавца один раз для всех его кабинетов,
+        пробуя по очереди токены пользователей, пока один не сработает
+    """
+    since, since_id = get_supplier_watermark(personals)
+    response = False, 'Вы не авторизованы в кабинете Wildberries'
+    for token in get_supplier_tokens(personals):
+        response = WBPersonalApiClient(personals[0].supplierId, token).get_new_feedbacks(since, since_id)
+        record_token_result(personals, token, response)
+        if response[0] or response[1] == 'Ошибка подключения':
+            return response
+    return response
+
+
 def get_suppliers(user: TelegramUser):
     if user.WBToken is None:
         return None, 'Вы не авторизованы в кабинете Wildberries'
     client = WBPersonalApiClient(WBToken=user.WBToken)
     response = client.get_suppliers()
     if response[0]:
-        for supplier in response[1]:
-            if not user.personal_set.filter(supplierId=supplier['id']).exists():
-                personal = user.personal_set.create(
-                    user=user,
-                    supplierId=supplier['id'],
-                    oldId=supplier['oldID'],
-                    name=supplier['name'],
-                    full_name=supplier['fullName']
-                )
-                logger.success(f'New personal added: {personal} {personal.supplierId}')
+        Personal = user.personal_set.model
+        Personal.objects.bulk_create(
+            [
+                Personal(user=user, supplierId=supplier.id, oldId=supplier.old_id, name=supplier.name, full_name=supplier.full_name)
+                for supplier in response[1]
+            ],
+            update_conflicts=True,
+            unique_fields=['user', 'supplierId'],
+            update_fields=['oldId', 'name', 'full_name']
+        )
+        logger.success('Personals saved [user: %s, suppliers: %i]' % (user.pk, len(response[1])))
         return True, user.personal_set.all()
     else:
         return False, response[1]
@@ -228,58 +399,27 @@ def get_tracked_articles(user: TelegramUser):
         return False, 'У вас нет добавленых кабинетов Wildberries'
 
 
-def scale_sheet(sheet: object, plus_size: int = 10):
-    dims = {}
-    for row in sheet.rows:
-        for cell in row:
-            if cell.value:
-                dims[cell.column_letter] = max((dims.get(cell.column_letter, 0), len(str(cell.value)) + plus_size))
-    for col, value in dims.items():
-        sheet.column_dimensions[col].width = value
-
-
 def get_tracked_articles_excel(user: TelegramUser, to_delete: bool = False):
     tracked_articles = get_tracked_articles(user)
     if tracked_articles[0] is None or tracked_articles[0] is False:
         return tracked_articles
-    wb = openpyxl.Workbook()
-    sheet = wb.active
 
     headers = [
         'Артикул WB', 'Артикул продавца'
     ]
+    fixed_widths = {1: 15}
 
     if to_delete:
         headers.append('Заполните да, если товар НЕ нужно отслеживать')
+        fixed_widths[3] = 28
 
-    sheet.cell(row=1, column=1).value = 'Список отслеживаемых артикулов'
-    for i, header in enumerate(headers):
-        sheet.cell(row=2, column=i+1).value = header
-    sheet.merge_cells(start_row=1, end_row=1, start_column=1, end_column=len(headers))
-    for row in range(1, 3):
-        for column in range(1, len(headers)+1):
-            cell = sheet.cell(row=row, column=column)
-            cell.fill = PatternFill(start_color=Color('B1A0C7'), end_color=Color('B1A0C7'), fill_type='solid')
-            cell.font = Font(bold=True, size=12)
-            cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-            cell.border = Border(left=Side(style='medium'), right=Side(style='medium'), top=Side(style='medium'), bottom=Side(style='medium'))
-
-    row = 3
-    for article in tracked_articles[1]:
-        sheet.cell(row=row, column=1).value = article.nmId
-        sheet.cell(row=row, column=1).alignment = Alignment(horizontal='center')
-        sheet.cell(row=row, column=1).hyperlink = f'https://www.wildberries.ru/catalog/{article.nmId}/detail.aspx?targetUrl=SP'
-        sheet.cell(row=row, column=2).value = article.article
-        row += 1
-    scale_sheet(sheet)
-    sheet.column_dimensions['A'].width = 15
-    if to_delete:
-        sheet.column_dimensions['C'].width = 28
-    file_stream = io.BytesIO()
-    wb.save(file_stream)
-
-    file_stream.seek(0)
-    return True, base64.b64encode(file_stream.read()).decode('utf-8')
+    return True, build_excel(
+        'Список отслеживаемых артикулов',
+        headers,
+        ([article.nmId, article.article] for article in tracked_articles[1]),
+        'Отслеживаемые артикулы.xlsx',
+        fixed_widths
+    )
 
 
 def get_stars_display(user: TelegramUser):
@@ -293,128 +433,109 @@ def get_personals_pages_current_page(keyboard: object):
 def get_personal_cards_excel(user: TelegramUser, personal: object):
     if user.WBToken is None:
         return False, 'Вы не авторизованы в кабинете Wildberries'
-    client = WBPersonalApiClient(personal.supplierId, user.WBToken)
-    cards = client.get_cards()
-    if cards[0] is False:
-        return cards
-    if len(cards[1]) == 0:
+    response = personal.refresh_cards()
+    cards = personal.card_set.order_by('-updated_at', 'nmId')
+    if response[0] is False and personal.cards_synced_at is None:
+        return response
+    if not cards.exists():
         return None, 'В данном кабинете нет карточек'
-    wb = openpyxl.Workbook()
-    sheet = wb.active
-
+    tracked_nmIds = personal.get_tracked_nmIds()
     headers = [
         'Артикул WB', 'Артикул продавца', 'Бренд', 'Предмет', 'Цвет', 'Размер', 'Баркод', 'Заполните да, если нужно отслеживать товар'
     ]
 
-    sheet.cell(row=1, column=1).value = 'Список товаров %s' % personal.name
-    for i, header in enumerate(headers):
-        sheet.cell(row=2, column=i+1).value = header
-    sheet.merge_cells(start_row=1, end_row=1, start_column=1, end_column=len(headers))
-    for row in range(1, 3):
-        for column in range(1, len(headers)+1):
-            cell = sheet.cell(row=row, column=column)
-            cell.fill = PatternFill(start_color=Color('B1A0C7'), end_color=Color('B1A0C7'), fill_type='solid')
-            cell.font = Font(bold=True, size=12)
-            cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-            cell.border = Border(left=Side(style='medium'), right=Side(style='medium'), top=Side(style='medium'), bottom=Side(style='medium'))
-
-    row = 3
-    for card in cards[1]:
-        sheet.cell(row=row, column=1).value = card['nmID']
-        sheet.cell(row=row, column=1).alignment = Alignment(horizontal='center')
-        sheet.cell(row=row, column=1).hyperlink = f'https://www.wildberries.ru/catalog/{card["nmID"]}/detail.aspx?targetUrl=SP'
-        sheet.cell(row=row, column=2).value = card['vendorCode']
-        sheet.cell(row=row, column=3).value = card['Бренд']
-        sheet.cell(row=row, column=4).value = card['Предмет']
-        sheet.cell(row=row, column=5).value = ', '.join(card['Цвет']) if len(card['Цвет']) != 0 else '-'
-        sheet.cell(row=row, column=6).value = card['size'][0].get('wbSize') if card['size'][0].get('wbSize') != '' else '-'
-        sheet.cell(row=row, column=7).value = card['size'][0].get('skus', [''])[0]
-        if personal.trackedarticle_set.filter(nmId=card['nmID']).exists():
-            sheet.cell(row=row, column=8).value = 'Уже отслеживается'
-
-        row += 1
-    scale_sheet(sheet)
-
-    sheet.column_dimensions['A'].width = 15
-    sheet.column_dimensions['G'].width = 15
-    sheet.column_dimensions['H'].width = 28
-
-    file_stream = io.BytesIO()
-    wb.save(file_stream)
-
-    file_stream.seek(0)
-    return True, base64.b64encode(file_stream.read()).decode('utf-8')
-
-
-def add_articles_to_track(personal: object, file: str):
+    return True, build_excel(
+        'Список товаров %s' % personal.name,
+        headers,
+        (get_card_excel_row(card, card.nmId in tracked_nmIds) for card in cards.iterator()),
+        'Товары кабинета.xlsx',
+        {1: 15, 7: 15, 8: 28}
+    )
+
+
+def get_card_excel_row(card: object, tracked: bool) -> list:
+    return [
+        int(card.nmId),
+        card.vendor_code,
+        card.brand,
+        card.subject,
+        card.color or '-',
+        card.size or '-',
+        card.barcode,
+        'Уже отслеживается' if tracked else None
+    ]
+
+
+def is_marked(value) -> bool:
+    return value is not None and str(value).strip().lower() == 'да'
+
+
+def read_excel_rows(file: BinaryPayload, min_row: int, max_col: int):
+    """
+        Строки листа как кортежи значений, книга читается в режиме read-only прямо из памяти
+
+        :return generator: None если это не файл Excel
+    """
     try:
-        wb = openpyxl.load_workbook(file)
+        wb = openpyxl.load_workbook(file.open(), read_only=True, data_only=True)
     except Exception:
+        return None
+
+    def rows():
+        try:
+            yield from wb.active.iter_rows(min_row=min_row, max_col=max_col, values_only=True)
+        finally:
+            wb.close()
+    return rows()
+
+
+def add_articles_to_track(personal: object, file: BinaryPayload):
+    rows = read_excel_rows(file, 3, 8)
+    if rows is None:
         return False, 'Это не похоже на файл Excel'
-    sheet = wb.active
-    added_articles = []
-    for row in range(3, sheet.max_row+1):
-        if sheet.cell(row=row, column=8).value is not None and sheet.cell(row=row, column=8).value.lower() == 'да':
-            added_articles.append(
-                personal.trackedarticle_set.create(
-                    nmId=sheet.cell(row=row, column=1).value,
-                    article=sheet.cell(row=row, column=2).value,
-                    brand=sheet.cell(row=row, column=3).value
-                )
-            )
+    marked = {}
+    for row in rows:
+        if row[0] is not None and is_marked(row[7]):
+            marked[str(row[0])] = row
+    tracked = set(personal.trackedarticle_set.filter(nmId__in=marked).values_list('nmId', flat=True))
+    # артикул продавца и бренд берутся из каталога карточек, в файле их могли изменить
+    cards = {card.nmId: card for card in personal.card_set.filter(nmId__in=marked).only('nmId', 'vendor_code', 'brand')}
+    TrackedArticle = personal.trackedarticle_set.model
+    added_articles = TrackedArticle.objects.bulk_create([
+        TrackedArticle(
+            personal=personal,
+            nmId=nmId,
+            article=cards[nmId].vendor_code if nmId in cards else row[1] or '',
+            brand=cards[nmId].brand if nmId in cards else row[2] or ''
+        )
+        for nmId, row in marked.items() if nmId not in tracked
+    ], ignore_conflicts=True)
     return True, added_articles
 
 
-def remove_articles_from_track(user: TelegramUser, file: str):
-    try:
-        wb = openpyxl.load_workbook(file)
-    except Exception:
+def remove_articles_from_track(user: TelegramUser, file: BinaryPayload):
+    rows = read_excel_rows(file, 3, 3)
+    if rows is None:
         return False, 'Это не похоже на файл Excel'
-    sheet = wb.active
-    removed_articles = []
-    for row in range(2, sheet.max_row+1):
-        nmId = sheet.cell(row=row, column=1).value
-        if sheet.cell(row=row, column=3).value is not None and sheet.cell(row=row, column=3).value.lower() == 'да':
-            for personal in user.personal_set.all():
-                if personal.trackedarticle_set.filter(nmId=str(nmId)).exists():
-                    tracked_article = personal.trackedarticle_set.get(nmId=str(nmId))
-                    removed_articles.append(tracked_article)
-                    tracked_article.delete()
+    nmIds = set(str(row[0]) for row in rows if row[0] is not None and is_marked(row[2]))
+    TrackedArticle = user.personal_set.model.trackedarticle_set.rel.related_model
+    tracked_articles = TrackedArticle.objects.filter(personal__user=user, nmId__in=nmIds)
+    removed_articles = list(tracked_articles)
+    tracked_articles.delete()
     return True, removed_articles
 
 
-def delete_files(path: list):
-    for file in path:
-        os.remove(file)
-
-
 def merge_card_images(photos: list):
-    images_paths = []
-    for photo in photos:
-        r = requests.get(photo)
-        im_fname = os.path.join(settings.STATICFILES_DIRS[0], '{}.{}'.format(uuid.uuid4().hex, photo.split('.')[-1]))
-        with open(im_fname, 'wb') as f:
-            f.write(r.content)
-        images_paths.append(im_fname)
-
-    images = [Image.open(x) for x in images_paths]
-
-    widths, heights = zip(*(i.size for i in images))
-
-    total_width = sum(widths)
-    max_height = max(heights)
-
-    new_im = Image.new('RGB', (total_width, max_height))
-
-    x_offset = 0
-    for im in images:
-        new_im.paste(im, (x_offset, 0))
-        x_offset += im.size[0]
-    file_stream = io.BytesIO()
-    new_im.save(file_stream, 'png')
-    file_stream.seek(0)
-    delete_files(images_paths)
-    return base64.b64encode(file_stream.read()).decode('utf-8')
+    """
+        Коллаж из фотографий отзыва
+
+        :return BinaryPayload: JPEG, None если ни одну фотографию загрузить не удалось
+    """
+    _, _, cell = get_collage_grid(len(photos))
+    images = fetch_images(photos, draft_size=(cell, cell))
+    if len(images) == 0:
+        return None
+    return BinaryPayload.from_bytes(render_collage(images), 'photo.jpg', JPEG_MIME_TYPE)
 
 
 def get_service_sacc():
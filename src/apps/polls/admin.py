@@ -1,4 +1,5 @@
-from apps.polls.models import Feedback, FeedbackPhoto, Personal, TrackedArticle
+from apps.polls.models import (Card, Feedback, FeedbackNotification,
+                               FeedbackPhoto, Personal, TrackedArticle)
 from django.contrib import admin  # noqa
 
 
@@ -12,6 +13,12 @@ class TrackedArticleAdmin(admin.ModelAdmin):
     pass
 
 
+@admin.register(Card)
+class CardAdmin(admin.ModelAdmin):
+    list_display = ('nmId', 'vendor_code', 'brand', 'subject', 'personal', 'updated_at')
+    search_fields = ('nmId', 'vendor_code')
+
+
 class FeedbackPhotoInline(admin.TabularInline):
     model = FeedbackPhoto
     extra = 1
@@ -22,3 +29,9 @@ class FeedbackPhotoInline(admin.TabularInline):
 class FeedbackAdmin(admin.ModelAdmin):
     inlines = (FeedbackPhotoInline, )
     list_display = ('id', 'article', 'stars')
+
+
+@admin.register(FeedbackNotification)
+class FeedbackNotificationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'feedback', 'created_at', 'sent_at', 'attempts')
+    list_filter = ('sent_at', )
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0007_remove_personal_sheetid'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='personal',
+            name='last_feedback_date',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Дата последнего полученного отзыва'),
+        ),
+        migrations.AddField(
+            model_name='personal',
+            name='last_feedback_id',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='WB ID последнего полученного отзыва'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0008_personal_last_feedback_date_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='personal',
+            name='feedback_rate',
+            field=models.FloatField(default=0, verbose_name='Отзывов в час (среднее)'),
+        ),
+        migrations.AddField(
+            model_name='personal',
+            name='last_poll_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Дата последнего опроса отзывов'),
+        ),
+        migrations.AddField(
+            model_name='personal',
+            name='next_poll_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Дата следующего опроса отзывов'),
+        ),
+    ]
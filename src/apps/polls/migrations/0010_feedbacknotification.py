@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:37
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0009_personal_feedback_rate_personal_last_poll_at_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedbackNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата следующей попытки отправки')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата отправки')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Неудачных попыток отправки')),
+                ('last_error', models.TextField(blank=True, verbose_name='Последняя ошибка')),
+                ('feedback', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='polls.feedback', verbose_name='Отзыв')),
+            ],
+            options={
+                'verbose_name': 'Уведомление об отзыве',
+                'verbose_name_plural': 'Очередь уведомлений об отзывах',
+                'indexes': [models.Index(condition=models.Q(('sent_at__isnull', True)), fields=['next_attempt_at'], name='feedbacknotification_pending')],
+            },
+        ),
+    ]
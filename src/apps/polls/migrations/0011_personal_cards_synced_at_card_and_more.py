@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0010_feedbacknotification'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='personal',
+            name='cards_synced_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Дата изменения последней загруженной карточки'),
+        ),
+        migrations.CreateModel(
+            name='Card',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nmId', models.CharField(max_length=20, verbose_name='Артикул WB')),
+                ('vendor_code', models.CharField(blank=True, max_length=255, verbose_name='Артикул продавца')),
+                ('brand', models.CharField(blank=True, max_length=255, verbose_name='Бренд')),
+                ('subject', models.CharField(blank=True, max_length=255, verbose_name='Предмет')),
+                ('color', models.CharField(blank=True, max_length=255, verbose_name='Цвет')),
+                ('size', models.CharField(blank=True, max_length=100, verbose_name='Размер')),
+                ('barcode', models.CharField(blank=True, max_length=100, verbose_name='Баркод')),
+                ('updated_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата изменения на WB')),
+                ('personal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.personal', verbose_name='Кабинет')),
+            ],
+            options={
+                'verbose_name': 'Карточка товара',
+                'verbose_name_plural': 'Карточки товаров',
+                'indexes': [models.Index(fields=['personal', '-updated_at'], name='card_personal_updated')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='card',
+            constraint=models.UniqueConstraint(fields=('personal', 'nmId'), name='card_personal_nmid_unique'),
+        ),
+    ]
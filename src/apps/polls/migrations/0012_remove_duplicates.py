@@ -0,0 +1,46 @@
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def get_duplicates(model, *fields) -> list:
+    """
+        Группы строк с одинаковыми fields: значения полей и pk самой старой строки группы
+    """
+    return list(
+        model.objects.values(*fields).annotate(keep_id=Min('pk'), rows=Count('pk')).filter(rows__gt=1).values_list(*fields, 'keep_id')
+    )
+
+
+def remove_duplicates(apps, schema_editor):
+    """
+        Перед уникальными ограничениями оставляет по одной строке на естественный ключ.
+        Артикулы лишних кабинетов и отзывы лишних артикулов переносятся на оставшиеся,
+        поэтому порядок: кабинеты, артикулы, отзывы
+    """
+    Personal = apps.get_model('polls', 'Personal')
+    TrackedArticle = apps.get_model('polls', 'TrackedArticle')
+    Feedback = apps.get_model('polls', 'Feedback')
+
+    for user_id, supplier_id, keep_id in get_duplicates(Personal, 'user', 'supplierId'):
+        extra = Personal.objects.filter(user_id=user_id, supplierId=supplier_id).exclude(pk=keep_id)
+        TrackedArticle.objects.filter(personal__in=extra).update(personal_id=keep_id)
+        extra.delete()
+
+    for personal_id, nmId, keep_id in get_duplicates(TrackedArticle, 'personal', 'nmId'):
+        extra = TrackedArticle.objects.filter(personal_id=personal_id, nmId=nmId).exclude(pk=keep_id)
+        Feedback.objects.filter(article__in=extra).update(article_id=keep_id)
+        extra.delete()
+
+    for article_id, wb_id, keep_id in get_duplicates(Feedback, 'article', 'wb_id'):
+        Feedback.objects.filter(article_id=article_id, wb_id=wb_id).exclude(pk=keep_id).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0011_personal_cards_synced_at_card_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0012_remove_duplicates'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='feedback',
+            constraint=models.UniqueConstraint(fields=('article', 'wb_id'), name='feedback_article_wb_id_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='personal',
+            constraint=models.UniqueConstraint(fields=('user', 'supplierId'), name='personal_user_supplier_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='trackedarticle',
+            constraint=models.UniqueConstraint(fields=('personal', 'nmId'), name='trackedarticle_personal_nmid_unique'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0013_feedback_feedback_article_wb_id_unique_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='personal',
+            name='cards_full_sync_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Дата последней полной загрузки карточек'),
+        ),
+    ]
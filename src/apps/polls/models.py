@@ -1,9 +1,30 @@
+from datetime import timedelta
+from html import escape
+
 from apps.bot.management.commands.bot import bot
+from apps.bot.models import TelegramUser
+from apps.bot.utils.constants import (DIGEST_FEEDBACK_TEXT_LENGTH,
+                                      FEEDBACK_RATE_SMOOTHING)
+from apps.bot.utils.records import CardRecord
 from apps.bot.utils.tools import WBPersonalApiClient
-from django.db import models  # noqa
+from django.conf import settings
+from django.db import models, transaction  # noqa
 from django.utils import timezone
 
 
+class PersonalQuerySet(models.QuerySet):
+
+    def pollable(self):
+        """
+            Кабинеты, которые нужно опрашивать: есть отслеживаемые артикулы, пользователь
+            авторизован и уведомления включены (TelegramUser.objects.notifiable)
+        """
+        return self.filter(
+            models.Exists(TrackedArticle.objects.filter(personal=models.OuterRef('pk'))),
+            user__in=TelegramUser.objects.notifiable()
+        )
+
+
 class Personal(models.Model):
 
     user = models.ForeignKey('bot.TelegramUser', on_delete=models.CASCADE)
@@ -11,10 +32,22 @@ class Personal(models.Model):
     oldId = models.IntegerField('Старый ID продавца', null=False, blank=False)
     name = models.CharField('Наименование', max_length=150, null=False, blank=False)
     full_name = models.TextField('Полное наименование', null=False, blank=False)
+    last_feedback_date = models.DateTimeField('Дата последнего полученного отзыва', null=True, blank=True)
+    last_feedback_id = models.CharField('WB ID последнего полученного отзыва', max_length=255, null=True, blank=True)
+    last_poll_at = models.DateTimeField('Дата последнего опроса отзывов', null=True, blank=True)
+    next_poll_at = models.DateTimeField('Дата следующего опроса отзывов', null=True, blank=True, db_index=True)
+    feedback_rate = models.FloatField('Отзывов в час (среднее)', default=0)
+    cards_synced_at = models.DateTimeField('Дата изменения последней загруженной карточки', null=True, blank=True)
+    cards_full_sync_at = models.DateTimeField('Дата последней полной загрузки карточек', null=True, blank=True)
+
+    objects = PersonalQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Кабинет WB'
         verbose_name_plural = 'Кабинеты WB'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'supplierId'], name='personal_user_supplier_unique')
+        ]
 
     def get_client(self):
         return WBPersonalApiClient(self.supplierId, self.user.WBToken)
@@ -22,6 +55,81 @@ class Personal(models.Model):
     def get_tracked_articles(self):
         return self.trackedarticle_set.all()
 
+    def get_tracked_nmIds(self) -> set:
+        """
+            Отслеживаемые артикулы кабинета одним запросом, для проверок в цикле
+        """
+        return set(self.trackedarticle_set.values_list('nmId', flat=True))
+
+    def is_cards_full_sync_due(self) -> bool:
+        return self.cards_full_sync_at is None or \
+            timezone.now() - self.cards_full_sync_at >= timedelta(seconds=settings.CARDS_FULL_SYNC_INTERVAL)
+
+    def refresh_cards(self):
+        """
+            Догружает в Card карточки, измененные с прошлой загрузки: WB отдает их
+            от новых к старым по updateAt, поэтому листать дальше cards_synced_at не нужно.
+            Первая загрузка и затем раз в CARDS_FULL_SYNC_INTERVAL - полные, после них
+            из каталога удаляются карточки, которых WB больше не отдает.
+            Если карточку изменили во время загрузки, страницы сдвигаются и она может прийти
+            дважды - остается первая (самая новая), иначе upsert затронул бы строку дважды
+        """
+        full = self.is_cards_full_sync_due()
+        response = self.get_client().get_updated_cards(None if full else self.cards_synced_at)
+        if response[0] is False:
+            return response
+        records = {}
+        for card in response[1]:
+            records.setdefault(card.nmId, card)
+        cards = [Card.from_record(self, card) for card in records.values()]
+        with transaction.atomic():
+            Card.objects.bulk_create(
+                cards,
+                update_conflicts=True,
+                unique_fields=['personal', 'nmId'],
+                update_fields=['vendor_code', 'brand', 'subject', 'color', 'size', 'barcode', 'updated_at']
+            )
+            update_fields = []
+            if full:
+                deleted = set(self.card_set.values_list('nmId', flat=True)) - set(records)
+                if len(deleted) != 0:
+                    self.card_set.filter(nmId__in=deleted).delete()
+                self.cards_full_sync_at = timezone.now()
+                update_fields.append('cards_full_sync_at')
+            synced_at = max((card.updated_at for card in cards if card.updated_at is not None), default=None)
+            if synced_at is not None and (self.cards_synced_at is None or synced_at > self.cards_synced_at):
+                self.cards_synced_at = synced_at
+                update_fields.append('cards_synced_at')
+            if len(update_fields) != 0:
+                self.save(update_fields=update_fields)
+        return True, cards
+
+    def set_feedbacks_watermark(self, feedbacks: list):
+        if len(feedbacks) == 0:
+            return
+        newest = feedbacks[0]
+        self.last_feedback_date = newest.created_date
+        self.last_feedback_id = newest.id
+        self.save(update_fields=['last_feedback_date', 'last_feedback_id'])
+
+    def schedule_next_poll(self, feedbacks_count: int):
+        """
+            Обновляет среднюю частоту отзывов кабинета и назначает следующий опрос так,
+            чтобы к нему в среднем накапливалось FEEDBACK_POLL_TARGET отзывов
+        """
+        now = timezone.now()
+        if self.last_poll_at is not None:
+            hours = max((now - self.last_poll_at).total_seconds(), 1) / 3600
+            self.feedback_rate = FEEDBACK_RATE_SMOOTHING * feedbacks_count / hours + (1 - FEEDBACK_RATE_SMOOTHING) * self.feedback_rate
+        if self.feedback_rate > 0:
+            interval = settings.FEEDBACK_POLL_TARGET / self.feedback_rate * 3600
+        else:
+            interval = settings.FEEDBACK_POLL_MAX_INTERVAL
+        interval = min(max(interval, settings.FEEDBACK_POLL_MIN_INTERVAL), settings.FEEDBACK_POLL_MAX_INTERVAL)
+        self.last_poll_at = now
+        self.next_poll_at = now + timedelta(seconds=interval)
+        self.save(update_fields=['feedback_rate', 'last_poll_at', 'next_poll_at'])
+
     def __str__(self):
         return self.name
 
@@ -36,11 +144,54 @@ class TrackedArticle(models.Model):
     class Meta:
         verbose_name = 'Отслеживаемый артикул'
         verbose_name_plural = 'Отслеживаемые артикулы'
+        constraints = [
+            models.UniqueConstraint(fields=['personal', 'nmId'], name='trackedarticle_personal_nmid_unique')
+        ]
 
     def __str__(self):
         return f'{self.nmId} {self.article}'
 
 
+class Card(models.Model):
+
+    personal = models.ForeignKey('polls.Personal', on_delete=models.CASCADE, verbose_name='Кабинет')
+    nmId = models.CharField('Артикул WB', max_length=20)
+    vendor_code = models.CharField('Артикул продавца', max_length=255, blank=True)
+    brand = models.CharField('Бренд', max_length=255, blank=True)
+    subject = models.CharField('Предмет', max_length=255, blank=True)
+    color = models.CharField('Цвет', max_length=255, blank=True)
+    size = models.CharField('Размер', max_length=100, blank=True)
+    barcode = models.CharField('Баркод', max_length=100, blank=True)
+    updated_at = models.DateTimeField('Дата изменения на WB', null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Карточка товара'
+        verbose_name_plural = 'Карточки товаров'
+        constraints = [
+            models.UniqueConstraint(fields=['personal', 'nmId'], name='card_personal_nmid_unique')
+        ]
+        indexes = [
+            models.Index(fields=['personal', '-updated_at'], name='card_personal_updated'),
+        ]
+
+    @classmethod
+    def from_record(cls, personal: Personal, card: CardRecord):
+        return cls(
+            personal=personal,
+            nmId=card.nmId,
+            vendor_code=card.vendor_code,
+            brand=card.brand,
+            subject=card.subject,
+            color=card.color,
+            size=card.size,
+            barcode=card.barcode,
+            updated_at=card.updated_at
+        )
+
+    def __str__(self):
+        return f'{self.nmId} {self.vendor_code}'
+
+
 class Feedback(models.Model):
 
     wb_id = models.CharField('WB ID', max_length=255, null=False, blank=False)
@@ -52,6 +203,9 @@ class Feedback(models.Model):
     class Meta:
         verbose_name = 'Отзыв об артикуле'
         verbose_name_plural = 'Отзывы об артикуле'
+        constraints = [
+            models.UniqueConstraint(fields=['article', 'wb_id'], name='feedback_article_wb_id_unique')
+        ]
 
     def format_notification_message(self):
         return '<b>🍇 %s</b>\n\n' % (self.article.personal.name) + \
@@ -61,6 +215,15 @@ class Feedback(models.Model):
                '<b>📃 Содержание отзыва:</b>\n%s\n\n' % (self.text) + \
                '<i>🕐 Дата отзыва:</i> %s' % (timezone.make_naive(self.created_date).strftime('%Y.%m.%d %H:%M:%S'))
 
+    def format_digest_message(self):
+        text = self.text if len(self.text) <= DIGEST_FEEDBACK_TEXT_LENGTH else self.text[:DIGEST_FEEDBACK_TEXT_LENGTH] + '…'
+        return f'🏷 <a href="https://www.wildberries.ru/catalog/{self.article.nmId}/detail.aspx?targetUrl=SP">{self.article.nmId}</a> | {self.article.article} | <i>{self.article.personal.name}</i>\n' + \
+               '%s %s\n' % ('⭐️' * self.stars, timezone.make_naive(self.created_date).strftime('%Y.%m.%d %H:%M')) + \
+               '%s\n\n' % escape(text)
+
+    def format_photo_caption(self):
+        return '🏷 %s | %s' % (self.article.nmId, escape(self.article.article))
+
     def send_notify(self):
         return bot.notify_new_feedback(self)
 
@@ -79,3 +242,35 @@ class FeedbackPhoto(models.Model):
 
     def __str__(self):
         return self.url
+
+
+class FeedbackNotification(models.Model):
+
+    feedback = models.OneToOneField('polls.Feedback', on_delete=models.CASCADE, verbose_name='Отзыв', null=False, blank=False)
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+    next_attempt_at = models.DateTimeField('Дата следующей попытки отправки', default=timezone.now)
+    sent_at = models.DateTimeField('Дата отправки', null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField('Неудачных попыток отправки', default=0)
+    last_error = models.TextField('Последняя ошибка', blank=True)
+
+    class Meta:
+        verbose_name = 'Уведомление об отзыве'
+        verbose_name_plural = 'Очередь уведомлений об отзывах'
+        indexes = [
+            models.Index(fields=['next_attempt_at'], condition=models.Q(sent_at__isnull=True), name='feedbacknotification_pending'),
+        ]
+
+    def mark_sent(self):
+        self.sent_at = timezone.now()
+        self.save(update_fields=['sent_at'])
+
+    def mark_failed(self, error: Exception):
+        self.attempts += 1
+        self.last_error = str(error)
+        self.next_attempt_at = timezone.now() + timedelta(
+            seconds=min(settings.FEEDBACK_NOTIFICATION_RETRY_MAX, settings.FEEDBACK_NOTIFICATION_RETRY_BASE * 2 ** self.attempts)
+        )
+        self.save(update_fields=['attempts', 'last_error', 'next_attempt_at'])
+
+    def __str__(self):
+        return f'{self.feedback} | {"отправлено" if self.sent_at is not None else "ожидает"}'
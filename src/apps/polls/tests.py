@@ -1,3 +1,7 @@
+from datetime import timedelta
+
+from apps.bot.models import TelegramUser
+from django.conf import settings
 from django.test import TestCase  # noqa
 from django.utils import timezone
 
@@ -10,3 +14,31 @@ class WBPersonalApiClientTestCase(TestCase):
     def tearDown(self):
         t = timezone.now() - self.start_time
         print(f'{self.id()}: {t}')
+
+
+class PersonalScheduleTestCase(TestCase):
+
+    def setUp(self):
+        self.start_time = timezone.now()
+        user = TelegramUser.objects.create(user_id=1, WBToken='token')
+        self.personal = user.personal_set.create(supplierId='supplier', oldId=1, name='ИП', full_name='ИП')
+
+    def tearDown(self):
+        t = timezone.now() - self.start_time
+        print(f'{self.id()}: {t}')
+
+    def test_dormant_personal_is_backed_off(self):
+        self.personal.schedule_next_poll(50)
+        self.assertEqual(self.personal.feedback_rate, 0)
+        self.personal.last_poll_at = timezone.now() - timedelta(hours=1)
+        self.personal.schedule_next_poll(0)
+        self.assertAlmostEqual(
+            (self.personal.next_poll_at - self.personal.last_poll_at).total_seconds(), settings.FEEDBACK_POLL_MAX_INTERVAL
+        )
+
+    def test_busy_personal_is_polled_often(self):
+        self.personal.last_poll_at = timezone.now() - timedelta(minutes=10)
+        self.personal.schedule_next_poll(100)
+        self.assertAlmostEqual(
+            (self.personal.next_poll_at - self.personal.last_poll_at).total_seconds(), settings.FEEDBACK_POLL_MIN_INTERVAL
+        )
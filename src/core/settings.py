@@ -111,6 +111,50 @@ CELERY_TIMEZONE = TIME_ZONE
 CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
+CELERY_BEAT_SCHEDULE = {
+    'send-feedback-notifications': {
+        'task': 'Send feedback notifications',
+        'schedule': 30.0,
+    },
+    'refresh-cards': {
+        'task': 'Refresh cards',
+        'schedule': float(os.getenv('CARDS_REFRESH_INTERVAL', 3600)),
+    },
+}
+
+FEEDBACK_POLL_CONCURRENCY = int(os.getenv('FEEDBACK_POLL_CONCURRENCY', 8))
+FEEDBACK_POLL_ENGINE = os.getenv('FEEDBACK_POLL_ENGINE', 'celery')
+FEEDBACK_POLL_MIN_INTERVAL = int(os.getenv('FEEDBACK_POLL_MIN_INTERVAL', 60))
+FEEDBACK_POLL_MAX_INTERVAL = int(os.getenv('FEEDBACK_POLL_MAX_INTERVAL', 3600))
+FEEDBACK_POLL_TARGET = float(os.getenv('FEEDBACK_POLL_TARGET', 1))
+FEEDBACK_POLL_LEASE_TTL = int(os.getenv('FEEDBACK_POLL_LEASE_TTL', 120))
+FEEDBACK_POLL_CYCLE_TTL = int(os.getenv('FEEDBACK_POLL_CYCLE_TTL', 600))
+
+FEEDBACK_NOTIFICATION_BATCH = int(os.getenv('FEEDBACK_NOTIFICATION_BATCH', 50))
+FEEDBACK_NOTIFICATION_MAX_ATTEMPTS = int(os.getenv('FEEDBACK_NOTIFICATION_MAX_ATTEMPTS', 8))
+FEEDBACK_NOTIFICATION_RETRY_BASE = int(os.getenv('FEEDBACK_NOTIFICATION_RETRY_BASE', 15))
+FEEDBACK_NOTIFICATION_RETRY_MAX = int(os.getenv('FEEDBACK_NOTIFICATION_RETRY_MAX', 3600))
+FEEDBACK_NOTIFICATION_CLAIM_TTL = int(os.getenv('FEEDBACK_NOTIFICATION_CLAIM_TTL', 300))
+
+CARDS_FULL_SYNC_INTERVAL = int(os.getenv('CARDS_FULL_SYNC_INTERVAL', 86400))
+
+WB_TOKEN_FAILURE_THRESHOLD = int(os.getenv('WB_TOKEN_FAILURE_THRESHOLD', 3))
+WB_TOKEN_PROBE_INTERVAL = int(os.getenv('WB_TOKEN_PROBE_INTERVAL', 900))
+WB_TOKEN_PROBE_MAX_INTERVAL = int(os.getenv('WB_TOKEN_PROBE_MAX_INTERVAL', 86400))
+
+WB_API_POOL_SIZE = int(os.getenv('WB_API_POOL_SIZE', 10))
+WB_API_CONNECT_TIMEOUT = float(os.getenv('WB_API_CONNECT_TIMEOUT', 5))
+WB_API_READ_TIMEOUT = float(os.getenv('WB_API_READ_TIMEOUT', 30))
+WB_API_RETRIES = int(os.getenv('WB_API_RETRIES', 3))
+WB_API_ASYNC_CONCURRENCY = int(os.getenv('WB_API_ASYNC_CONCURRENCY', 50))
+WB_API_CARDS_CONCURRENCY = int(os.getenv('WB_API_CARDS_CONCURRENCY', 4))
+WB_API_RATE = float(os.getenv('WB_API_RATE', 2))
+WB_API_BURST = int(os.getenv('WB_API_BURST', 5))
+WB_API_MAX_ATTEMPTS = int(os.getenv('WB_API_MAX_ATTEMPTS', 4))
+WB_API_BACKOFF_BASE = float(os.getenv('WB_API_BACKOFF_BASE', 1))
+WB_API_BACKOFF_MAX = float(os.getenv('WB_API_BACKOFF_MAX', 60))
+IMAGE_FETCH_CONCURRENCY = int(os.getenv('IMAGE_FETCH_CONCURRENCY', 8))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv('IMAGE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
 
 CACHES = {
     'default': {
@@ -124,6 +168,11 @@ X_FRAME_OPTIONS = 'SAMEORIGIN'
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', '')
 TELEGRAM_ADMIN_USER_ID = os.getenv('TELEGRAM_ADMIN_USER_ID', '')
 SPREADSHEET_ID = os.getenv('SPREADSHEET_ID', '')
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', 30))
+TELEGRAM_BULK_RATE = float(os.getenv('TELEGRAM_BULK_RATE', 20))
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', 1))
+TELEGRAM_CHAT_BURST = int(os.getenv('TELEGRAM_CHAT_BURST', 3))
+TELEGRAM_SEND_MAX_ATTEMPTS = int(os.getenv('TELEGRAM_SEND_MAX_ATTEMPTS', 5))
 
 if DEBUG is False:
     LOGGING = {